@@ -1,94 +1,351 @@
+import struct
 import logging
 from io import BytesIO
-from typing import Dict, Optional, Any
+from typing import Dict, Iterator, Optional, Any, Tuple
 from PIL import Image, ExifTags
 import traceback
-from datetime import datetime
+from app.utils.datetime_utils import parse_exif_datetime
 
 logger = logging.getLogger(__name__)
 
+# EXIF标签名映射表，提升为模块常量以减少循环中的属性查找
+TAGS = ExifTags.TAGS
+GPSTAGS = ExifTags.GPSTAGS
+
+# Exif子IFD的标签号，DateTimeOriginal等拍摄信息位于其中
+EXIF_IFD_TAG = 0x8769
+
+# GPSInfo子IFD的标签号及其中经纬度字段的标签号
+GPS_IFD_TAG = 0x8825
+GPS_LAT_REF = 1
+GPS_LAT = 2
+GPS_LON_REF = 3
+GPS_LON = 4
+
+# get_image_info需要保留的EXIF字段，预先映射为(标签号, 标签名)
+_WANTED_TAG_NAMES = ('DateTime', 'DateTimeOriginal', 'DateTimeDigitized', 'Make', 'Model')
+_WANTED_TAGS = tuple((tag_id, name) for tag_id, name in TAGS.items() if name in _WANTED_TAG_NAMES)
+
+
+# JPEG文件起始标记(SOI)、EXIF所在的APP1段标记及扫描数据开始标记(SOS)
+JPEG_SOI = b'\xff\xd8'
+JPEG_APP1 = 0xE1
+JPEG_SOS = 0xDA
+# 不带长度字段的独立标记：TEM、RST0-RST7
+_JPEG_STANDALONE_MARKERS = frozenset([0x01, *range(0xD0, 0xD8)])
+# APP1段中EXIF数据的标识头
+_EXIF_HEADER = b'Exif\x00\x00'
+
+
+def _iter_jpeg_segments(data: bytes) -> Iterator[Tuple[int, int, int]]:
+    """依次产出JPEG文件头中各段的(标记, 段起始位置, 段结束位置)，到SOS段或数据不完整、结构异常时停止"""
+    if not data.startswith(JPEG_SOI):
+        return
+
+    pos, size = 2, len(data)
+    while pos + 4 <= size:
+        if data[pos] != 0xFF:
+            return
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # 标记前的填充字节
+            pos += 1
+            continue
+        if marker in _JPEG_STANDALONE_MARKERS:
+            pos += 2
+            continue
+
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+        yield marker, pos, end
+        if marker == JPEG_SOS:
+            return
+        pos = end
+
+
+# 判断文件格式所需的最少字节数
+MAGIC_LENGTH = 12
+
+
+def is_exif_capable(head: bytes) -> bool:
+    """
+    按文件头的魔数判断图片格式能否携带EXIF（JPEG、TIFF、PNG、WebP），只做字节比较
+
+    Args:
+        head: 文件开头至少MAGIC_LENGTH个字节
+
+    Returns:
+        格式可能包含EXIF时返回True
+    """
+    return (
+        head[:3] == b'\xff\xd8\xff'
+        or head[:4] in (b'II*\x00', b'MM\x00*')
+        or head[:8] == b'\x89PNG\r\n\x1a\n'
+        or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+    )
+
+
+def jpeg_header_length(data: bytes) -> Optional[int]:
+    """
+    计算JPEG文件头的长度（从SOI到SOS段结束），EXIF(APP1)和图像尺寸(SOF)都位于其中
+
+    Args:
+        data: JPEG文件开头部分的数据
+
+    Returns:
+        文件头的字节数；数据不完整、不是JPEG或结构异常时返回None
+    """
+    for marker, _, end in _iter_jpeg_segments(data):
+        if marker == JPEG_SOS and end <= len(data):
+            return end
+    return None
+
+
+# TIFF各数据类型的单个值字节数：BYTE、ASCII、SHORT、LONG、RATIONAL、UNDEFINED、SLONG、SRATIONAL、IFD
+_TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8, 13: 4}
+_TIFF_INT_FORMATS = {1: 'B', 3: 'H', 4: 'I', 9: 'i', 13: 'I'}
+_TIFF_RATIONAL_FORMATS = {5: 'II', 10: 'ii'}
+
+# 指向子IFD的标签，其值必须是单个整数偏移量
+_IFD_POINTER_TAGS = frozenset([EXIF_IFD_TAG, GPS_IFD_TAG])
+
+# 快速解析时各IFD中需要读取的标签
+_IFD0_WANTED = frozenset(tag_id for tag_id, _ in _WANTED_TAGS) | {EXIF_IFD_TAG, GPS_IFD_TAG}
+_EXIF_IFD_WANTED = frozenset(tag_id for tag_id, _ in _WANTED_TAGS)
+_GPS_IFD_WANTED = frozenset([GPS_LAT_REF, GPS_LAT, GPS_LON_REF, GPS_LON])
+
+
+def _slice_app1(data: bytes) -> Optional[bytes]:
+    """在JPEG文件头中找到EXIF所在的APP1段，返回其中的TIFF数据，没有时返回None"""
+    for marker, start, end in _iter_jpeg_segments(data):
+        if marker == JPEG_APP1 and data[start + 4:start + 10] == _EXIF_HEADER:
+            return data[start + 10:end] if end <= len(data) else None
+    return None
+
+
+def _decode_tiff_value(raw: bytes, field_type: int, count: int, endian: str) -> Any:
+    """按TIFF数据类型解码标签值，与Pillow的解码结果保持一致（单个值不包装为元组）"""
+    if field_type == 2:
+        if raw.endswith(b'\0'):
+            raw = raw[:-1]
+        return raw.decode('latin-1', 'replace')
+
+    if field_type in _TIFF_RATIONAL_FORMATS:
+        nums = struct.unpack(endian + _TIFF_RATIONAL_FORMATS[field_type] * count, raw)
+        values = tuple(n / d if d else float('nan') for n, d in zip(nums[::2], nums[1::2]))
+    elif field_type in _TIFF_INT_FORMATS:
+        values = struct.unpack(endian + _TIFF_INT_FORMATS[field_type] * count, raw)
+    else:
+        return raw
+    return values[0] if count == 1 else values
+
+
+def _read_ifd(tiff: bytes, endian: str, offset: int, wanted: frozenset) -> Dict[int, Any]:
+    """
+    读取一个IFD中需要的标签，其余标签的值（如MakerNote）不做解码
+
+    子IFD指针的类型或个数无法识别时抛出ValueError，避免静默丢失GPS和拍摄时间
+    """
+    (count,) = struct.unpack_from(endian + 'H', tiff, offset)
+    result = {}
+    for entry in range(offset + 2, offset + 2 + 12 * count, 12):
+        tag, field_type, n, value = struct.unpack_from(endian + 'HHI4s', tiff, entry)
+        if tag not in wanted:
+            continue
+        if tag in _IFD_POINTER_TAGS and (field_type not in _TIFF_INT_FORMATS or n != 1):
+            raise ValueError(f"无法识别的子IFD指针: 标签{tag}, 类型{field_type}, 个数{n}")
+        if field_type not in _TIFF_TYPE_SIZES:
+            continue
+
+        length = _TIFF_TYPE_SIZES[field_type] * n
+        if length <= 4:
+            raw = value[:length]
+        else:
+            (value_offset,) = struct.unpack(endian + 'I', value)
+            raw = tiff[value_offset:value_offset + length]
+            if len(raw) < length:
+                raise ValueError(f"标签{tag}的数据越界")
+        result[tag] = _decode_tiff_value(raw, field_type, n, endian)
+    return result
+
+
+def _read_jpeg_exif(data: bytes) -> Optional[Dict[int, Any]]:
+    """
+    直接解析JPEG中APP1段的TIFF结构，只读取时间、设备和经纬度相关的标签
+
+    返回与_read_exif相同结构的字典；没有EXIF段或解析失败时返回None，由调用方退回Pillow解析
+    """
+    tiff = _slice_app1(data)
+    if not tiff:
+        return None
+
+    try:
+        if tiff[:2] == b'II':
+            endian = '<'
+        elif tiff[:2] == b'MM':
+            endian = '>'
+        else:
+            return None
+
+        (ifd0_offset,) = struct.unpack_from(endian + 'I', tiff, 4)
+        exif_data = _read_ifd(tiff, endian, ifd0_offset, _IFD0_WANTED)
+
+        # 指针存在时必须能跟随，越界等错误会抛出异常并退回Pillow解析
+        exif_offset = exif_data.pop(EXIF_IFD_TAG, None)
+        if exif_offset is not None:
+            exif_data.update(_read_ifd(tiff, endian, exif_offset, _EXIF_IFD_WANTED))
+
+        gps_offset = exif_data.pop(GPS_IFD_TAG, None)
+        if gps_offset is not None:
+            gps_info = _read_ifd(tiff, endian, gps_offset, _GPS_IFD_WANTED)
+            if gps_info:
+                exif_data[GPS_IFD_TAG] = gps_info
+        return exif_data
+
+    except (struct.error, ValueError) as e:
+        logger.warning("快速解析EXIF失败，改用Pillow解析: %s", e)
+        return None
+
+
+def _read_exif(img: Image.Image) -> Optional[Dict[int, Any]]:
+    """
+    读取EXIF数据，返回与旧版_getexif()相同结构的字典
+
+    使用Pillow的getexif()/get_ifd()只解析IFD0、Exif和GPS子IFD，
+    GPS子IFD放在GPS_IFD_TAG下，没有EXIF时返回None
+    """
+    if not hasattr(img, 'getexif'):
+        # 旧版Pillow兼容
+        return getattr(img, '_getexif', lambda: None)()
+
+    exif = img.getexif()
+    if not exif:
+        return None
+
+    exif_data = dict(exif)
+    exif_data.update(exif.get_ifd(EXIF_IFD_TAG))
+
+    # IFD0中的GPS_IFD_TAG只是偏移量，替换为解析后的GPS子IFD
+    gps_info = exif.get_ifd(GPS_IFD_TAG)
+    if gps_info:
+        exif_data[GPS_IFD_TAG] = gps_info
+    else:
+        exif_data.pop(GPS_IFD_TAG, None)
+
+    return exif_data
+
+
+def _to_float(value) -> float:
+    """将EXIF有理数（IFDRational或(分子, 分母)元组）转换为浮点数"""
+    if isinstance(value, tuple):
+        return value[0] / value[1]
+    return float(value)
+
+
+def _dms_to_decimal(degree_data, ref) -> float:
+    """将度分秒格式的坐标转换为十进制度数"""
+    d, m, s = degree_data
+    decimal = _to_float(d) + _to_float(m) / 60.0 + _to_float(s) / 3600.0
+    if ref in ('S', 'W'):
+        decimal = -decimal
+    return decimal
+
 
 class ImageProcessor:
     """处理图像并提取地理位置信息"""
 
+    @staticmethod
+    def _open_image(image_data: bytes) -> Tuple[Dict[str, Any], Optional[Dict[int, Any]]]:
+        """打开图像，只读取文件头和EXIF（只解析一次），不解码像素"""
+        with Image.open(BytesIO(image_data)) as img:
+            header = {
+                'format': img.format,
+                'size': img.size,
+                'mode': img.mode
+            }
+            # JPEG直接解析APP1段中需要的标签，无法快速解析时使用Pillow完整解析
+            exif = _read_jpeg_exif(image_data) if img.format == 'JPEG' else None
+            if exif is None:
+                exif = _read_exif(img)
+        return header, exif
+
+    def extract_all(self, image_data: bytes) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """
+        一次性提取GPS坐标和图像基本信息，图像只打开一次、EXIF只解析一次
+
+        Args:
+            image_data: 图像二进制数据
+
+        Returns:
+            (GPS信息, 图像基本信息)，与extract_gps_from_image和get_image_info的返回值一致
+        """
+        try:
+            header, exif = self._open_image(image_data)
+        except Exception as e:
+            logger.error(f"打开图像时出错: {str(e)}")
+            if logger.isEnabledFor(logging.ERROR):
+                logger.error(traceback.format_exc())
+            return None, {}
+
+        return self._gps_from_exif(exif), self._info_from_exif(header, exif)
+
     def extract_gps_from_image(self, image_data: bytes) -> Optional[Dict[str, Any]]:
-        """从图像中提取GPS坐标信息"""
+        """从图像中提取GPS坐标信息，同时需要图像信息时请使用extract_all"""
+        try:
+            _, exif = self._open_image(image_data)
+        except Exception as e:
+            logger.error(f"提取GPS信息时出错: {str(e)}")
+            if logger.isEnabledFor(logging.ERROR):
+                logger.error(traceback.format_exc())
+            return None
+
+        return self._gps_from_exif(exif)
+
+    def get_image_info(self, image_data: bytes) -> Dict[str, Any]:
+        """获取图像基本信息，包括时间等EXIF数据，同时需要GPS信息时请使用extract_all"""
         try:
-            # 使用PIL打开图像
-            img = Image.open(BytesIO(image_data))
+            header, exif = self._open_image(image_data)
+        except Exception as e:
+            logger.error(f"获取图像信息时出错: {str(e)}")
+            return {}
+
+        return self._info_from_exif(header, exif)
 
-            # 检查是否有EXIF数据
-            if not hasattr(img, '_getexif') or img._getexif() is None:
+    def _gps_from_exif(self, exif_data: Optional[Dict[int, Any]]) -> Optional[Dict[str, Any]]:
+        """从已解析的EXIF数据中提取GPS坐标信息"""
+        try:
+            if exif_data is None:
                 logger.warning("图片没有EXIF数据")
                 return None
 
-            # 获取所有EXIF数据
-            exif_data = img._getexif()
-            logger.info(f"EXIF标签: {[ExifTags.TAGS.get(tag, tag) for tag in exif_data.keys()]}")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f"EXIF标签: {[TAGS.get(tag, tag) for tag in exif_data.keys()]}")
 
-            # 找到GPS信息对应的标签
-            gps_info = None
-            for tag, value in exif_data.items():
-                tag_name = ExifTags.TAGS.get(tag, tag)
-                if tag_name == 'GPSInfo':
-                    gps_info = value
-                    break
+            # 按标签号直接取GPS信息
+            gps_info = exif_data.get(GPS_IFD_TAG)
 
             if not gps_info:
                 logger.warning("图片中没有GPS信息")
                 return None
 
             # 打印GPS信息标签
-            gps_tags = {key: ExifTags.GPSTAGS.get(key, key) for key in gps_info.keys()}
-            logger.info(f"GPS标签: {gps_tags}")
+            if logger.isEnabledFor(logging.INFO):
+                gps_tags = {key: GPSTAGS.get(key, key) for key in gps_info.keys()}
+                logger.info(f"GPS标签: {gps_tags}")
 
             # 解析GPS数据
-            lat_ref = lon_ref = None
-            lat_deg = lon_deg = None
-
-            for key, val in gps_info.items():
-                tag_name = ExifTags.GPSTAGS.get(key, key)
-                if tag_name == 'GPSLatitudeRef':
-                    lat_ref = val
-                elif tag_name == 'GPSLatitude':
-                    lat_deg = val
-                elif tag_name == 'GPSLongitudeRef':
-                    lon_ref = val
-                elif tag_name == 'GPSLongitude':
-                    lon_deg = val
-
-            logger.info(f"GPS原始数据: lat_ref={lat_ref}, lat_deg={lat_deg}, lon_ref={lon_ref}, lon_deg={lon_deg}")
+            lat_ref, lat_deg = gps_info.get(GPS_LAT_REF), gps_info.get(GPS_LAT)
+            lon_ref, lon_deg = gps_info.get(GPS_LON_REF), gps_info.get(GPS_LON)
+
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f"GPS原始数据: lat_ref={lat_ref}, lat_deg={lat_deg}, lon_ref={lon_ref}, lon_deg={lon_deg}")
 
             if not (lat_ref and lon_ref and lat_deg and lon_deg):
                 logger.warning("GPS信息不完整")
                 return None
 
             # 转换为十进制坐标
-            def to_decimal(degree_data, ref):
-                d, m, s = degree_data
-                # 处理不同类型的数据
-                if isinstance(d, tuple):
-                    d = float(d[0]) / float(d[1])
-                else:
-                    d = float(d)
-
-                if isinstance(m, tuple):
-                    m = float(m[0]) / float(m[1])
-                else:
-                    m = float(m)
-
-                if isinstance(s, tuple):
-                    s = float(s[0]) / float(s[1])
-                else:
-                    s = float(s)
-
-                decimal = d + (m / 60.0) + (s / 3600.0)
-                if ref in ['S', 'W']:
-                    decimal = -decimal
-                return decimal
-
-            latitude = to_decimal(lat_deg, lat_ref)
-            longitude = to_decimal(lon_deg, lon_ref)
+            latitude = _dms_to_decimal(lat_deg, lat_ref)
+            longitude = _dms_to_decimal(lon_deg, lon_ref)
 
             logger.info(f"成功提取GPS坐标: 纬度={latitude}, 经度={longitude}")
 
@@ -100,41 +357,32 @@ class ImageProcessor:
 
         except Exception as e:
             logger.error(f"提取GPS信息时出错: {str(e)}")
-            logger.error(traceback.format_exc())
+            if logger.isEnabledFor(logging.ERROR):
+                logger.error(traceback.format_exc())
             return None
 
-    def get_image_info(self, image_data: bytes) -> Dict[str, Any]:
-        """获取图像基本信息，包括时间等EXIF数据"""
+    def _info_from_exif(self, header: Dict[str, Any], exif: Optional[Dict[int, Any]]) -> Dict[str, Any]:
+        """在图像文件头信息基础上，补充时间等EXIF数据"""
         try:
-            img = Image.open(BytesIO(image_data))
-            info = {
-                'format': img.format,
-                'size': img.size,
-                'mode': img.mode
-            }
+            info = dict(header)
+
+            if exif:
+                # 只取需要的EXIF信息（时间相关信息用于排序）
+                for tag_id, tag_name in _WANTED_TAGS:
+                    if tag_id in exif:
+                        info[tag_name] = exif[tag_id]
 
-            # 获取EXIF信息
-            if hasattr(img, '_getexif') and img._getexif():
-                exif = img._getexif()
-                if exif:
-                    # 添加所有有用的EXIF信息
-                    for tag, tag_value in exif.items():
-                        tag_name = ExifTags.TAGS.get(tag, str(tag))
-                        # 保留时间相关信息，用于排序
-                        if tag_name in ['DateTime', 'DateTimeOriginal', 'DateTimeDigitized', 'Make', 'Model']:
-                            info[tag_name] = tag_value
-
-                    # 尝试格式化时间信息以便前端展示
-                    if 'DateTimeOriginal' in info or 'DateTime' in info:
-                        timestamp = info.get('DateTimeOriginal', info.get('DateTime', ''))
-                        try:
-                            dt = datetime.strptime(timestamp, '%Y:%m:%d %H:%M:%S')
-                            info['formatted_time'] = dt.strftime('%Y-%m-%d %H:%M:%S')
-                        except ValueError:
-                            logger.warning(f"无法解析时间格式: {timestamp}")
+                # 尝试格式化时间信息以便前端展示
+                if 'DateTimeOriginal' in info or 'DateTime' in info:
+                    timestamp = info.get('DateTimeOriginal', info.get('DateTime', ''))
+                    dt = parse_exif_datetime(timestamp)
+                    if dt:
+                        info['formatted_time'] = dt.strftime('%Y-%m-%d %H:%M:%S')
+                    else:
+                        logger.warning(f"无法解析时间格式: {timestamp}")
 
             return info
 
         except Exception as e:
             logger.error(f"获取图像信息时出错: {str(e)}")
-            return {}
\ No newline at end of file
+            return {}
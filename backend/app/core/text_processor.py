@@ -1,7 +1,10 @@
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import json
 from datetime import datetime
+from app.services.amap_service import GEOCODE_BATCH_SIZE
+from app.utils.datetime_utils import parse_exif_datetime
 
 logger = logging.getLogger(__name__)
 
@@ -14,19 +17,25 @@ class TextProcessor:
         self.amap_service = amap_service
 
     # 保持原有方法不变
-    def process_text(self, text: str) -> Dict[str, Any]:
+    async def process_text(self, text: str, stream: bool = True) -> Dict[str, Any]:
         """
         处理文本，提取地址、构建行程链
 
         Args:
             text: 输入文本
+            stream: 是否流式提取地址，边生成边地理编码；为False时等待模型完整返回后再批量编码
 
         Returns:
             处理结果，包含地址和行程信息
         """
         try:
             # 提取地址
-            addresses = self.qwen_service.extract_addresses(text)
+            if stream:
+                addresses, geocoded = await self._extract_and_geocode(text)
+            else:
+                addresses = await self.qwen_service.extract_addresses(text)
+                geocoded = None
+
             if not addresses:
                 return {
                     "success": False,
@@ -36,15 +45,16 @@ class TextProcessor:
 
             logger.info(f"提取到{len(addresses)}个地址")
 
-            # 地理编码
+            # 批量地理编码
+            addr_list = [addr_info.get("address", "") for addr_info in addresses]
+            if geocoded is None:
+                geocoded = await self.amap_service.geocode_batch(addr_list)
+
             locations = []
-            for addr_info in addresses:
-                address = addr_info.get("address", "")
+            for addr_info, address, location in zip(addresses, addr_list, geocoded):
                 if not address:
                     continue
 
-                # 地理编码
-                location = self.amap_service.geocode(address)
                 if location:
                     # 合并地址信息和地理编码结果
                     location.update(addr_info)
@@ -60,24 +70,18 @@ class TextProcessor:
                 }
 
             # 构建行程链
-            itinerary = self.qwen_service.build_itinerary(locations, text)
+            itinerary = await self.qwen_service.build_itinerary(locations, text)
 
             # 如果有两个以上地点，生成路径
             route_data = None
             if len(itinerary) >= 2:
-                origin = f"{itinerary[0]['longitude']},{itinerary[0]['latitude']}"
-                destination = f"{itinerary[-1]['longitude']},{itinerary[-1]['latitude']}"
-
-                # 处理途经点
-                waypoints = None
-                if len(itinerary) > 2:
-                    waypoint_list = []
-                    for loc in itinerary[1:-1]:
-                        waypoint_list.append(f"{loc['longitude']},{loc['latitude']}")
-                    waypoints = ";".join(waypoint_list)
+                # 一次性生成所有坐标串，首尾为起终点，中间为途经点
+                coords = [f"{loc['longitude']},{loc['latitude']}" for loc in itinerary]
+                origin, destination = coords[0], coords[-1]
+                waypoints = ";".join(coords[1:-1]) or None
 
                 # 规划路径
-                route_data = self.amap_service.plan_route(
+                route_data = await self.amap_service.plan_route(
                     origin=origin,
                     destination=destination,
                     waypoints=waypoints
@@ -104,6 +108,63 @@ class TextProcessor:
                 "addresses": []
             }
 
+    async def _extract_and_geocode(self, text: str) -> Tuple[List[Dict[str, Any]], List[Optional[Dict[str, Any]]]]:
+        """
+        流式提取地址的同时进行地理编码，模型生成与高德请求重叠进行
+
+        已到达但尚未发送的地址会合并为一次批量请求（最多GEOCODE_BATCH_SIZE个）
+
+        Args:
+            text: 输入文本
+
+        Returns:
+            (地址列表, 与地址一一对应的地理编码结果)
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        addresses: List[Dict[str, Any]] = []
+
+        async def produce():
+            try:
+                async for addr_info in self.qwen_service.stream_addresses(text):
+                    addresses.append(addr_info)
+                    queue.put_nowait(len(addresses) - 1)
+            finally:
+                # None表示模型输出结束
+                queue.put_nowait(None)
+
+        producer = asyncio.create_task(produce())
+        pending = []
+        try:
+            finished = False
+            while not finished:
+                index = await queue.get()
+                if index is None:
+                    break
+
+                group = [index]
+                while len(group) < GEOCODE_BATCH_SIZE and not queue.empty():
+                    index = queue.get_nowait()
+                    if index is None:
+                        finished = True
+                        break
+                    group.append(index)
+
+                addr_list = [addresses[i].get("address", "") for i in group]
+                pending.append((group, asyncio.create_task(self.amap_service.geocode_batch(addr_list))))
+
+            await producer
+            results = await asyncio.gather(*(task for _, task in pending))
+        finally:
+            # 请求被取消或某批编码出错时，停止模型输出和其余的编码请求
+            for task in [producer, *(task for _, task in pending)]:
+                task.cancel()
+
+        geocoded: List[Optional[Dict[str, Any]]] = [None] * len(addresses)
+        for (group, _), locations in zip(pending, results):
+            for i, location in zip(group, locations):
+                geocoded[i] = location
+        return addresses, geocoded
+
     # 添加新方法，不修改现有功能
     def sort_locations_by_time(self, locations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
@@ -116,10 +177,10 @@ class TextProcessor:
             按时间排序后的位置列表
         """
         try:
-            # 检查是否有时间信息可排序
-            locations_with_time = []
+            # 为每个位置计算排序键（时间, 原始下标），不修改原始数据
+            keyed = []
 
-            for location in locations:
+            for idx, location in enumerate(locations):
                 timestamp = None
 
                 # 尝试不同的时间字段
@@ -130,33 +191,19 @@ class TextProcessor:
                 elif 'timestamp' in location:
                     timestamp = location['timestamp']
 
+                parsed_time = None
                 if timestamp:
-                    try:
-                        # 尝试解析时间字符串
-                        # 支持多种格式，如 "2023:05:20 14:35:42" 或 "2023-05-20 14:35:42"
-                        timestamp_str = str(timestamp).replace(':', '-', 2)
-                        dt = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                        location['parsed_time'] = dt
-                        locations_with_time.append(location)
-                    except ValueError as e:
-                        logger.warning(f"无法解析时间戳 '{timestamp}': {str(e)}")
-                        locations_with_time.append(location)
-                else:
-                    # 没有时间信息的位置
-                    locations_with_time.append(location)
-
-            # 按时间排序，没有时间的位置保持原来顺序
-            def sort_key(loc):
-                return loc.get('parsed_time', datetime.max)
-
-            sorted_locations = sorted(locations_with_time, key=sort_key)
+                    # 尝试解析时间字符串
+                    # 支持多种格式，如 "2023:05:20 14:35:42" 或 "2023-05-20 14:35:42"
+                    parsed_time = parse_exif_datetime(timestamp)
+                    if not parsed_time:
+                        logger.warning(f"无法解析时间戳 '{timestamp}'")
 
-            # 清理临时字段
-            for location in sorted_locations:
-                if 'parsed_time' in location:
-                    del location['parsed_time']
+                keyed.append((parsed_time or datetime.max, idx, location))
 
-            return sorted_locations
+            # 按时间排序，没有时间的位置排在最后，下标保证保持原来顺序
+            keyed.sort(key=lambda t: (t[0], t[1]))
+            return [t[2] for t in keyed]
 
         except Exception as e:
             logger.error(f"排序位置时出错: {str(e)}")
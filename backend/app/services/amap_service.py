@@ -1,13 +1,210 @@
 import os
 import json
 import logging
+import asyncio
 import hashlib
+import time
+import threading
+import traceback
 import urllib.parse
-from typing import Dict, Any, List, Optional
-import requests
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, TypedDict
+import httpx
+from app.utils.sqlite_cache import SQLiteCache
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时退回标准库解析
+    orjson = None
+
+try:
+    import h2  # noqa: F401  httpx的HTTP/2支持依赖h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# 高德批量地理编码单次请求最多支持的地址数
+GEOCODE_BATCH_SIZE = 10
+# 请求高德API的超时时间（秒）
+REQUEST_TIMEOUT = 5
+# 空闲连接的保持时间（秒），两次用户请求之间无需重新握手
+KEEPALIVE_EXPIRY = 60
+
+
+class GeocodeResult(TypedDict):
+    """地理编码结果，运行时仍是普通字典，可直接合并其他字段并序列化返回前端"""
+    latitude: float
+    longitude: float
+    formatted_address: str
+    province: str
+    city: str
+    district: str
+    adcode: str
+    level: str
+
+
+class MapPoint(TypedDict):
+    """前端地图渲染使用的位置点"""
+    lnglat: List[float]
+    name: str
+    type: str
+    index: int
+
+
+def _create_client() -> httpx.AsyncClient:
+    """
+    创建带连接池的异步HTTP客户端，连接失败时自动重试
+
+    安装了h2时启用HTTP/2，并发的地理编码和路径规划请求可复用同一条TCP连接
+    """
+    limits = httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=KEEPALIVE_EXPIRY)
+    return httpx.AsyncClient(
+        timeout=REQUEST_TIMEOUT,
+        limits=limits,
+        # 使用自定义transport时，http2和limits需要设置在transport上才会生效
+        transport=httpx.AsyncHTTPTransport(retries=2, http2=HTTP2_AVAILABLE, limits=limits),
+    )
+
+
+# 进程内共享的客户端，复用TCP/TLS连接，首次使用时创建
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    """获取共享的HTTP客户端，尚未创建或已被关闭时重新创建"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+async def aclose_client() -> None:
+    """关闭共享的HTTP客户端，在应用退出时调用"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _parse_json(response: httpx.Response) -> Any:
+    """解析响应JSON，优先使用orjson"""
+    return _loads_json(response.content)
+
+
+def _loads_json(raw: bytes) -> Any:
+    """解析JSON字节串，优先使用orjson"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+# 地理编码结果缓存：进程内LRU在前，持久化的SQLite在后，只缓存成功的结果，结果过期后重新查询
+GEOCODE_CACHE_SIZE = 4096
+AMAP_GEOCODE_CACHE_TTL = float(os.getenv('AMAP_GEOCODE_CACHE_TTL', str(30 * 24 * 3600)))
+AMAP_GEOCODE_CACHE_MAX_ROWS = int(os.getenv('AMAP_GEOCODE_CACHE_MAX_ROWS', '100000'))
+_geocode_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_geocode_cache_lock = threading.Lock()
+_geocode_store = SQLiteCache(
+    os.getenv('AMAP_CACHE_PATH', '.amap_cache.sqlite3'),
+    ttl=AMAP_GEOCODE_CACHE_TTL,
+    max_rows=AMAP_GEOCODE_CACHE_MAX_ROWS,
+)
+
+
+def _normalize_address(address: str) -> str:
+    """规范化地址作为缓存键，忽略首尾空白、连续空白和大小写差异"""
+    return ' '.join(address.split()).lower()
+
+
+def _geocode_memory_get(key: str) -> Optional[Dict[str, Any]]:
+    """读取进程内LRU，未命中或已过期时返回None"""
+    with _geocode_cache_lock:
+        entry = _geocode_cache.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if expires_at > time.monotonic():
+                _geocode_cache.move_to_end(key)
+                return dict(result)
+            del _geocode_cache[key]
+    return None
+
+
+async def _geocode_cache_get(address: str) -> Optional[Dict[str, Any]]:
+    """读取缓存，返回副本以免调用方修改结果污染缓存"""
+    key = _normalize_address(address)
+    result = _geocode_memory_get(key)
+    if result is not None:
+        return result
+
+    # 进程内未命中时在线程池中查询持久化缓存，命中后回填
+    raw = await _geocode_store.aget(key)
+    if raw is None:
+        return None
+    try:
+        result = json.loads(raw)
+    except ValueError as e:
+        logger.warning("地理编码缓存内容无效，重新查询: %s", e)
+        return None
+    _geocode_cache_set(key, result)
+    return dict(result)
+
+
+def _geocode_cache_set(key: str, result: Dict[str, Any]) -> None:
+    """写入进程内LRU，超出容量时淘汰最久未使用的条目"""
+    with _geocode_cache_lock:
+        _geocode_cache[key] = (time.monotonic() + AMAP_GEOCODE_CACHE_TTL, dict(result))
+        _geocode_cache.move_to_end(key)
+        if len(_geocode_cache) > GEOCODE_CACHE_SIZE:
+            _geocode_cache.popitem(last=False)
+
+
+async def _geocode_cache_put(address: str, result: Dict[str, Any]) -> None:
+    """同时写入进程内LRU和持久化缓存，持久化缓存在线程池中写入"""
+    key = _normalize_address(address)
+    _geocode_cache_set(key, result)
+    await _geocode_store.aset(key, json.dumps(result, ensure_ascii=False))
+
+
+# 路径规划结果缓存：相同坐标的请求直接复用，路况会变化，因此只保留ROUTE_CACHE_TTL秒
+# 保存原始响应字节，每次命中时重新解析，调用方修改返回结果不会影响缓存
+ROUTE_CACHE_SIZE = 256
+ROUTE_CACHE_TTL = 600
+_route_cache: "OrderedDict[Tuple[str, ...], Tuple[float, bytes]]" = OrderedDict()
+_route_cache_lock = threading.Lock()
+
+
+def _round_coords(coords: str) -> str:
+    """将"lng,lat"（多个用";"分隔）保留到小数点后6位，高德接口要求坐标不超过6位小数"""
+    return ';'.join(
+        ','.join(f"{float(v):.6f}".rstrip('0').rstrip('.') for v in point.split(','))
+        for point in coords.split(';')
+    )
+
+
+def _route_cache_get(key: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    """读取未过期的路径缓存，返回新解析的对象"""
+    with _route_cache_lock:
+        entry = _route_cache.get(key)
+        if entry is None:
+            return None
+        expires, raw = entry
+        if expires <= time.monotonic():
+            del _route_cache[key]
+            return None
+        _route_cache.move_to_end(key)
+    return _loads_json(raw)
+
+
+def _route_cache_set(key: Tuple[str, ...], raw: bytes) -> None:
+    """写入路径规划的原始响应，超出容量时淘汰最久未使用的条目"""
+    with _route_cache_lock:
+        _route_cache[key] = (time.monotonic() + ROUTE_CACHE_TTL, raw)
+        _route_cache.move_to_end(key)
+        if len(_route_cache) > ROUTE_CACHE_SIZE:
+            _route_cache.popitem(last=False)
+
 
 class AMapService:
     """高德地图服务封装"""
@@ -17,35 +214,36 @@ class AMapService:
         if not self.api_key:
             logger.warning("未设置AMAP_API_KEY环境变量，高德地图服务将无法正常工作")
 
+        # 数字签名密钥（可选），只在初始化时读取一次
+        self.api_secret = os.getenv('AMAP_SECRET')
+        # 签名时直接使用预先编码的密钥，避免每次请求重复编码
+        self._secret_bytes = (self.api_secret or '').encode('utf-8')
+
         self.base_url = "https://restapi.amap.com/v3"
 
+    @property
+    def _client(self) -> httpx.AsyncClient:
+        """每次请求时获取共享的HTTP客户端，服务实例被长期缓存，不持有已关闭的客户端"""
+        return _get_client()
+
     def _generate_signature(self, params: Dict[str, str]) -> str:
         """
         生成数字签名（高德地图Web服务API数字签名）
         https://lbs.amap.com/api/webservice/guide/create-project/signature
         """
-        api_secret = os.getenv('AMAP_SECRET')
-        if not api_secret:
+        if not self.api_secret:
             return ""
 
-        # 将参数排序
-        sorted_params = sorted(params.items())
-
-        # 将所有参数按key=value的格式拼接
-        param_str = ''
-        for key, value in sorted_params:
-            param_str += f"{key}={value}&"
-        param_str = param_str[:-1]  # 去除最后的&符号
-
-        # 拼接密钥
-        str_to_sign = param_str + api_secret
+        # 将参数按key排序后以key=value&...拼接（使用原始值，不做URL编码），再拼接密钥
+        param_str = '&'.join(f"{key}={value}" for key, value in sorted(params.items()))
 
-        # 使用MD5算法计算签名
-        signature = hashlib.md5(str_to_sign.encode()).hexdigest()
+        # 使用MD5算法计算签名（高德签名协议规定），参数串和密钥分别写入，不再拼接出完整的待签名字符串
+        h = hashlib.md5()
+        h.update(param_str.encode('utf-8'))
+        h.update(self._secret_bytes)
+        return h.hexdigest()
 
-        return signature
-
-    def geocode(self, address: str) -> Optional[Dict[str, Any]]:
+    async def geocode(self, address: str) -> Optional[Dict[str, Any]]:
         """
         地理编码，将地址转换为经纬度坐标
         https://lbs.amap.com/api/webservice/guide/api/georegeo
@@ -57,7 +255,13 @@ class AMapService:
                 logger.warning("地址为空")
                 return None
 
-            logger.info(f"正在地理编码地址: {address}")
+            # 优先使用缓存
+            cached = await _geocode_cache_get(address)
+            if cached:
+                logger.info("地理编码命中缓存: %s", address)
+                return cached
+
+            logger.info("正在地理编码地址: %s", address)
 
             # 构建参数
             params = {
@@ -69,46 +273,133 @@ class AMapService:
             }
 
             # 生成签名
-            api_secret = os.getenv('AMAP_SECRET')
-            if api_secret:
+            if self.api_secret:
                 params['sig'] = self._generate_signature(params)
 
             # 发送请求
-            response = requests.get(f"{self.base_url}/geocode/geo", params=params, timeout=5)
-            data = response.json()
+            response = await self._client.get(f"{self.base_url}/geocode/geo", params=params)
+            data = _parse_json(response)
 
             # 记录原始响应
-            logger.info(f"地理编码响应: {data}")
+            logger.info("地理编码响应: %s", data)
 
             # 检查结果
             if data.get('status') == '1' and data.get('geocodes') and len(data['geocodes']) > 0:
-                result = data['geocodes'][0]
-                # 提取经纬度
-                location = result.get('location', '')
-                if location:
-                    lng, lat = location.split(',')
-                    geo_result = {
-                        'latitude': float(lat),
-                        'longitude': float(lng),
-                        'formatted_address': result.get('formatted_address', ''),
-                        'province': result.get('province', ''),
-                        'city': result.get('city', ''),
-                        'district': result.get('district', ''),
-                        'adcode': result.get('adcode', ''),
-                        'level': result.get('level', '')
-                    }
-                    logger.info(f"地理编码成功: {address} -> [{lng},{lat}]")
+                geo_result = self._parse_geocode(data['geocodes'][0])
+                if geo_result:
+                    logger.info("地理编码成功: %s -> [%s,%s]", address, geo_result['longitude'], geo_result['latitude'])
+                    await _geocode_cache_put(address, geo_result)
                     return geo_result
 
-            logger.warning(f"地理编码失败，地址: {address}, 响应: {data}")
+            logger.warning("地理编码失败，地址: %s, 响应: %s", address, data)
             return None
 
         except Exception as e:
-            logger.error(f"地理编码过程中出错: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.error("地理编码过程中出错: %s", e)
+            if logger.isEnabledFor(logging.ERROR):
+                logger.error(traceback.format_exc())
             return None
 
+    @staticmethod
+    def _parse_geocode(result: Dict[str, Any]) -> Optional[GeocodeResult]:
+        """将高德地理编码返回的单条结果转换为统一的位置字典"""
+        # 批量模式下未匹配的地址会返回空的location
+        location = result.get('location')
+        if not location or not isinstance(location, str):
+            return None
+
+        lng, lat = location.split(',')
+        return {
+            'latitude': float(lat),
+            'longitude': float(lng),
+            'formatted_address': result.get('formatted_address', ''),
+            'province': result.get('province', ''),
+            'city': result.get('city', ''),
+            'district': result.get('district', ''),
+            'adcode': result.get('adcode', ''),
+            'level': result.get('level', '')
+        }
+
+    async def geocode_batch(self, addresses: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        批量地理编码，每次请求最多合并10个地址
+        https://lbs.amap.com/api/webservice/guide/api/georegeo
+
+        Args:
+            addresses: 地址列表
+
+        Returns:
+            与输入顺序一一对应的地理编码结果，失败的地址对应None
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(addresses)
+
+        # 过滤空地址，记录原始下标；地址中的"|"会破坏批量分隔，需要去掉
+        indexed = [(i, addr.strip().replace('|', ' '))
+                   for i, addr in enumerate(addresses) if addr and addr.strip()]
+
+        # 命中缓存的地址不再发送请求
+        cached_results = await asyncio.gather(*(_geocode_cache_get(addr) for _, addr in indexed))
+        pending = []
+        for (index, addr), cached in zip(indexed, cached_results):
+            if cached:
+                results[index] = cached
+            else:
+                pending.append((index, addr))
+        indexed = pending
+
+        chunks = [indexed[start:start + GEOCODE_BATCH_SIZE]
+                  for start in range(0, len(indexed), GEOCODE_BATCH_SIZE)]
+        if not chunks:
+            return results
+
+        # 并发发送各批请求
+        chunk_results = await asyncio.gather(*(self._geocode_chunk(chunk) for chunk in chunks))
+
+        puts = []
+        for chunk, geo_results in zip(chunks, chunk_results):
+            for (index, addr), geo_result in zip(chunk, geo_results):
+                if geo_result:
+                    puts.append(_geocode_cache_put(addr, geo_result))
+                results[index] = geo_result
+        await asyncio.gather(*puts)
+
+        return results
+
+    async def _geocode_chunk(self, chunk: List[Tuple[int, str]]) -> List[Optional[Dict[str, Any]]]:
+        """发送一次批量地理编码请求，返回与chunk顺序对应的结果"""
+        geo_results: List[Optional[Dict[str, Any]]] = [None] * len(chunk)
+        try:
+            params = {
+                'key': self.api_key,
+                'address': '|'.join(addr for _, addr in chunk),
+                'batch': 'true',
+                'output': 'JSON',
+            }
+
+            # 生成签名
+            if self.api_secret:
+                params['sig'] = self._generate_signature(params)
+
+            response = await self._client.get(f"{self.base_url}/geocode/geo", params=params)
+            data = _parse_json(response)
+
+            if data.get('status') != '1':
+                logger.warning("批量地理编码失败，地址: %s, 响应: %s", params['address'], data)
+                return geo_results
+
+            # 批量模式下geocodes与输入地址按顺序一一对应
+            for i, ((_, addr), result) in enumerate(zip(chunk, data.get('geocodes') or [])):
+                geo_results[i] = self._parse_geocode(result)
+                if geo_results[i] is None:
+                    logger.warning("地理编码失败，地址: %s", addr)
+
+        except Exception as e:
+            logger.error("批量地理编码过程中出错: %s", e)
+            if logger.isEnabledFor(logging.ERROR):
+                logger.error(traceback.format_exc())
+
+        return geo_results
+
     def _select_best_geocode_result(self, candidates: List[Dict], address_info: Dict) -> Dict:
         """从多个候选结果中选择最佳匹配"""
         # 如果有城市信息，优先选择匹配该城市的结果
@@ -150,7 +441,7 @@ class AMapService:
         # 返回得分最高的结果
         return scored_candidates[0][1]
 
-    def plan_route(self,
+    async def plan_route(self,
                    origin: str,
                    destination: str,
                    waypoints: str = None,
@@ -175,6 +466,17 @@ class AMapService:
             }
             endpoint = endpoint_map.get(mode, 'direction/driving')
 
+            # 坐标统一保留6位小数，同时作为缓存键
+            origin, destination = _round_coords(origin), _round_coords(destination)
+            if waypoints:
+                waypoints = _round_coords(waypoints)
+
+            cache_key = (endpoint, origin, destination, waypoints or '')
+            cached = _route_cache_get(cache_key)
+            if cached is not None:
+                logger.info("路径规划命中缓存")
+                return cached
+
             # 构建基本参数
             params = {
                 'key': self.api_key,
@@ -193,24 +495,24 @@ class AMapService:
                 params['strategy'] = '10'  # 速度优先
 
             # 生成签名
-            api_secret = os.getenv('AMAP_SECRET')
-            if api_secret:
+            if self.api_secret:
                 params['sig'] = self._generate_signature(params)
 
             # 发送请求
             url = f"{self.base_url}/{endpoint}"
-            response = requests.get(url, params=params)
-            data = response.json()
+            response = await self._client.get(url, params=params)
+            data = _parse_json(response)
 
             # 检查结果
             if data.get('status') == '1':
+                _route_cache_set(cache_key, response.content)
                 return data
 
-            logger.warning(f"路径规划失败，参数: {params}, 响应: {data}")
+            logger.warning("路径规划失败，参数: %s, 响应: %s", params, data)
             return None
 
         except Exception as e:
-            logger.error(f"路径规划过程中出错: {str(e)}")
+            logger.error("路径规划过程中出错: %s", e)
             return None
 
     def get_static_map(self, locations: List[Dict[str, Any]], zoom: int = 13) -> str:
@@ -245,69 +547,46 @@ class AMapService:
                 params['zoom'] = str(zoom)
                 params['markers'] = f"mid,0xFF0000,A:{markers[0]}"
             else:
-                # 多点地图 - 需要特别处理
-
-                # 1. 构建标记参数
-                marker_parts = []
-                for i, marker in enumerate(markers):
-                    # 根据位置设置不同颜色
-                    if i == 0:  # 起点
-                        color = '0xFF0000'  # 红色
-                    elif i == len(markers) - 1:  # 终点
-                        color = '0x00FF00'  # 绿色
-                    else:  # 途经点
-                        color = '0x0000FF'  # 蓝色
-
-                    # 使用字母作为标记
-                    label = chr(65 + i) if i < 26 else str(i + 1)
-                    marker_parts.append(f"mid,{color},{label}:{marker}")
-
-                # 将标记参数用"|"连接
-                params['markers'] = "|".join(marker_parts)
-
-                # 2. 添加路径连线
-                # 注意：路径线必须符合特定格式，宽度,颜色,透明度,线形
-                if len(markers) >= 2:
-                    path_str = ';'.join(markers)
-                    # 宽度为5像素，蓝色，透明度1.0，实线
-                    params['path'] = f"5,0x0000FF,1,0:{path_str}"
+                # 多点地图：起点红色、途经点蓝色、终点绿色，使用字母作为标记
+                n = len(markers)
+                colors = ('0xFF0000',) + ('0x0000FF',) * (n - 2) + ('0x00FF00',)
+                labels = [chr(65 + i) if i < 26 else str(i + 1) for i in range(n)]
+                params['markers'] = "|".join(
+                    f"mid,{color},{label}:{marker}" for color, label, marker in zip(colors, labels, markers)
+                )
+
+                # 添加路径连线，格式为 宽度,颜色,透明度,线形
+                # 宽度为5像素，蓝色，透明度1.0，实线
+                params['path'] = f"5,0x0000FF,1,0:{';'.join(markers)}"
 
             # 生成签名
-            api_secret = os.getenv('AMAP_SECRET')
-            if api_secret:
+            if self.api_secret:
                 # 确保所有参数值都是字符串
                 string_params = {k: str(v) for k, v in params.items()}
                 params['sig'] = self._generate_signature(string_params)
 
-            # 构建URL - 确保正确编码
-            base_url = "https://restapi.amap.com/v3/staticmap"
-            query_parts = []
-
-            for k, v in params.items():
-                # 对值进行URL编码，但保留某些特殊字符
-                if k in ['markers', 'path']:
-                    # 这些参数需要特殊处理，因为它们包含特殊符号如冒号、竖线等
-                    encoded_v = v.replace('|', '%7C')
-                    query_parts.append(f"{k}={encoded_v}")
-                else:
-                    query_parts.append(f"{k}={urllib.parse.quote(str(v))}")
-
-            query_string = "&".join(query_parts)
-            full_url = f"{base_url}?{query_string}"
+            # 构建URL，markers/path中的冒号、逗号、分号保持原样，竖线编码为%7C
+            query_string = urllib.parse.urlencode(params, safe=':,;', quote_via=urllib.parse.quote)
+            full_url = f"{self.base_url}/staticmap?{query_string}"
 
-            logger.info(f"生成的静态地图URL: {full_url}")
+            # URL较长，仅在DEBUG级别输出
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("生成的静态地图URL: %s", full_url)
             return full_url
 
         except Exception as e:
-            logger.error(f"生成静态地图过程中出错: {str(e)}")
+            logger.error("生成静态地图过程中出错: %s", e)
             return ""
 
-    def prepare_map_data(self, locations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def prepare_map_data(self,
+                               locations: List[Dict[str, Any]],
+                               route_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         准备前端地图渲染所需的数据
 
         Args:
             locations: 位置点列表
+            route_data: 调用方已规划好的路径数据(可选)，提供时不再重复请求路径规划
 
         Returns:
             包含地图渲染所需数据的字典
@@ -316,10 +595,12 @@ class AMapService:
             return {"success": False, "message": "无位置数据"}
 
         # 记录日志以便调试
-        logger.info(f"准备地图数据，共{len(locations)}个位置点")
+        logger.info("准备地图数据，共%d个位置点", len(locations))
 
-        # 提取位置点信息
-        map_points = []
+        # 提取位置点信息，同时收集坐标串供路径规划使用
+        map_points: List[MapPoint] = []
+        coords = []
+        last = len(locations) - 1
         for i, loc in enumerate(locations):
             if 'longitude' in loc and 'latitude' in loc:
                 # 确保经纬度是浮点数
@@ -327,11 +608,11 @@ class AMapService:
                 lat = float(loc['latitude'])
 
                 # 确定点类型
-                point_type = "起点" if i == 0 else "终点" if i == len(locations) - 1 else "途经点"
+                point_type = "起点" if i == 0 else "终点" if i == last else "途经点"
 
                 # 获取地址信息
                 address = loc.get('formatted_address', '') or loc.get('address', '')
-                logger.info(f"点{i + 1}: 类型={point_type}, 坐标=[{lng},{lat}], 地址={address}")
+                logger.info("点%d: 类型=%s, 坐标=[%s,%s], 地址=%s", i + 1, point_type, lng, lat, address)
 
                 map_points.append({
                     "lnglat": [lng, lat],
@@ -339,34 +620,27 @@ class AMapService:
                     "type": point_type,
                     "index": i
                 })
+                coords.append(f"{lng},{lat}")
 
-        # 如果有多个点，获取路径规划数据
-        route_data = None
-        if len(map_points) >= 2:
+        # 如果有多个点且调用方未提供路径，获取路径规划数据
+        if route_data is None and len(map_points) >= 2:
             try:
-                # 构建起点终点坐标
-                start = f"{map_points[0]['lnglat'][0]},{map_points[0]['lnglat'][1]}"
-                end = f"{map_points[-1]['lnglat'][0]},{map_points[-1]['lnglat'][1]}"
-
-                # 处理途经点
-                waypoints = None
-                if len(map_points) > 2:
-                    waypoint_coords = []
-                    for point in map_points[1:-1]:
-                        waypoint_coords.append(f"{point['lnglat'][0]},{point['lnglat'][1]}")
-                    waypoints = ";".join(waypoint_coords)
-                    logger.info(f"途经点: {waypoints}")
+                # 首尾为起终点，中间为途经点
+                start, end = coords[0], coords[-1]
+                waypoints = ";".join(coords[1:-1]) or None
+                if waypoints:
+                    logger.info("途经点: %s", waypoints)
 
                 # 获取路径规划数据
-                route_result = self.plan_route(start, end, waypoints)
+                route_result = await self.plan_route(start, end, waypoints)
 
                 if route_result and route_result.get('status') == '1':
                     route_data = route_result
                     logger.info("路径规划数据获取成功")
                 else:
-                    logger.warning(f"路径规划失败: {route_result}")
+                    logger.warning("路径规划失败: %s", route_result)
             except Exception as e:
-                logger.error(f"获取路径数据出错: {str(e)}")
+                logger.error("获取路径数据出错: %s", e)
 
         result = {
             "success": True,
@@ -376,7 +650,7 @@ class AMapService:
         }
 
         # 记录完整的结果（仅用于调试）
-        logger.info(
-            f"地图数据准备完成: 成功={result['success']}, 点数={len(result['points'])}, 是否有路线={result['routeData'] is not None}")
+        logger.info("地图数据准备完成: 成功=%s, 点数=%d, 是否有路线=%s",
+                    result['success'], len(result['points']), result['routeData'] is not None)
 
         return result
\ No newline at end of file
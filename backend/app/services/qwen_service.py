@@ -1,11 +1,275 @@
 import os
+import re
 import json
+import time
 import logging
-from typing import Dict, Any, List, Optional
-from openai import OpenAI
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, AsyncIterator, Callable
+from openai import AsyncOpenAI
+from app.utils.sqlite_cache import SQLiteCache
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时退回标准库解析
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# 模型返回中 ```json ... ``` 代码块内的JSON
+_FENCED_JSON_RE = re.compile(r"```(?:json)?\s*(\{.*?\}|\[.*?\])\s*```", re.DOTALL)
+# 没有代码块时匹配的裸JSON
+_BARE_JSON_RE = re.compile(r"\{.*\}|\[.*\]", re.DOTALL)
+
+
+def _extract_json(content: str) -> str:
+    """
+    从模型返回内容中取出JSON文本，匹配失败时原样返回
+
+    先查找代码块，只有没有代码块时才匹配裸JSON，避免代码块之前说明文字中的括号被当作JSON的开头
+    """
+    m = _FENCED_JSON_RE.search(content)
+    if m:
+        return m.group(1)
+    m = _BARE_JSON_RE.search(content)
+    return m.group(0) if m else content
+
+
+def _loads(json_str: str) -> Any:
+    """解析JSON，优先使用orjson，解析失败时均抛出json.JSONDecodeError（或其子类）"""
+    if orjson is not None:
+        return orjson.loads(json_str)
+    return json.loads(json_str)
+
+
+def _dumps(obj: Any) -> str:
+    """序列化为JSON字符串（保留中文），优先使用orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False)
+
+
+class _JsonArrayItemParser:
+    """增量解析JSON数组，每当一个顶层元素（对象或数组）完整出现时返回其文本"""
+
+    def __init__(self):
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item: List[str] = []
+        self._count = 0
+
+    @property
+    def finished(self) -> bool:
+        """是否已读到数组的结束括号，未结束说明输出被截断"""
+        return self._finished
+
+    def feed(self, text: str) -> List[str]:
+        """输入新到达的文本，返回本次新完成的元素"""
+        items = []
+        for ch in text:
+            if self._finished:
+                break
+            if not self._started:
+                # 跳过代码块标记等数组之前的内容
+                if ch == '[':
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            in_item = self._depth >= 2
+            if self._in_string:
+                if in_item:
+                    self._item.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 1:
+                    self._item.append(ch)
+                    items.append(''.join(self._item))
+                    self._item = []
+                    self._count += 1
+                    continue
+                if self._depth == 0:
+                    if self._count:
+                        self._finished = True
+                    else:
+                        # 没有元素的数组视为说明文字中的括号（如"[共2个]"），继续查找后面的数组
+                        self._started = False
+                    continue
+
+            if self._depth >= 2:
+                self._item.append(ch)
+        return items
+
+
+# 持久化的模型响应缓存，只保存解析成功后规范化的JSON，相同的请求直接返回上次的结果
+QWEN_CACHE_TTL = float(os.getenv('QWEN_CACHE_TTL', str(7 * 24 * 3600)))
+QWEN_CACHE_MAX_ROWS = int(os.getenv('QWEN_CACHE_MAX_ROWS', '10000'))
+_cache = SQLiteCache(
+    os.getenv('QWEN_CACHE_PATH', '.qwen_cache.sqlite3'),
+    ttl=QWEN_CACHE_TTL,
+    max_rows=QWEN_CACHE_MAX_ROWS,
+)
+
+# 调用失败的请求在短时间内不再重试，避免服务故障时反复请求
+# 按失败时间排序，过期时间相同，最早的条目总是最先过期；条目数有上限，避免内存无限增长
+FAILURE_TTL = 60
+FAILURE_CACHE_SIZE = 1024
+_recent_failures: "OrderedDict[str, float]" = OrderedDict()
+
+# 短于该长度的文本不可能包含有效地址（中文地名最短两个字，如"上海"）
+MIN_ADDRESS_TEXT_LEN = 2
+
+
+def _failed_recently(key: str) -> bool:
+    """判断相同请求是否在FAILURE_TTL秒内失败过"""
+    expires = _recent_failures.get(key)
+    if expires is None:
+        return False
+    if expires <= time.monotonic():
+        _recent_failures.pop(key, None)
+        return False
+    return True
+
+
+def _mark_failed(key: str):
+    """记录调用失败的请求，同时清理已过期的条目，超出容量时淘汰最早的条目"""
+    now = time.monotonic()
+    while _recent_failures:
+        oldest_key, expires = next(iter(_recent_failures.items()))
+        if expires > now:
+            break
+        del _recent_failures[oldest_key]
+
+    _recent_failures[key] = now + FAILURE_TTL
+    _recent_failures.move_to_end(key)
+    if len(_recent_failures) > FAILURE_CACHE_SIZE:
+        _recent_failures.popitem(last=False)
+
+
+def _is_trivial_text(text: Optional[str]) -> bool:
+    """文本为空或过短时无需调用模型"""
+    return not text or len(text.strip()) < MIN_ADDRESS_TEXT_LEN
+
+
+# 地址提取的系统提示词，内容固定，可被服务端前缀缓存
+_ADDRESS_SYSTEM_PROMPT = (
+    "你是一个专业的地理信息提取助手，请从用户给出的文本中提取所有地址，并完善为尽可能完整的地址。\n"
+    "规则：\n"
+    "1. 默认所有地点都在同一城市内，除非文本明确提到不同城市\n"
+    "2. 补全省份、城市、区县等缺失信息，使用中国地名习惯\n"
+    "3. 文本未明确指出城市时，从上下文和地点特征推断最可能的城市\n"
+    "4. 只返回JSON数组，不要有其他解释，格式：\n"
+    '[{"address": "完整地址文本", "province": "省份", "city": "城市", "district": "区县", '
+    '"detail": "详细地址", "time_mentioned": "相关时间信息(如有)", "confidence": 0.9}]\n'
+    "其中confidence为地址识别置信度，取值0-1"
+)
+
+# 行程排序的系统提示词，模型只返回地点序号，不再复述完整的地点信息
+_ITINERARY_SYSTEM_PROMPT = """你是一个专业的行程规划助手，请为用户给出的地点安排最合理的访问顺序。
+规则：
+1. 如果有明确的时间提及，按时间顺序排列
+2. 如果地点在不同城市，按照文本描述的顺序排列
+3. 如果在同一城市内，根据地理位置和合理的访问路线进行排序
+4. 考虑文本中的行程逻辑，比如"从A出发，经过B，最后到达C"
+5. 只返回按访问顺序排列的地点序号(index)组成的JSON数组，如[2, 0, 1]，不要有其他解释"""
+
+# 地址提取和行程排序的最大输出token数；每个地址对象约60-90个token，地址提取按约25个地址预留
+ADDRESS_MAX_TOKENS = 2048
+ITINERARY_MAX_TOKENS = 256
+
+
+def _apply_order(locations: List[Dict[str, Any]], order: Any) -> List[Dict[str, Any]]:
+    """按模型返回的序号重排地点，忽略无效或重复的序号，遗漏的地点按原顺序追加在末尾"""
+    if not isinstance(order, list):
+        return locations
+
+    seen = set()
+    result = []
+    for i in order:
+        if isinstance(i, int) and not isinstance(i, bool) and 0 <= i < len(locations) and i not in seen:
+            seen.add(i)
+            result.append(locations[i])
+    result.extend(loc for i, loc in enumerate(locations) if i not in seen)
+    return result
+
+
+def _parse_addresses(content: str) -> List[Dict[str, Any]]:
+    """解析地址提取结果，只保留对象元素，结果不是JSON数组时抛出ValueError"""
+    addresses = _loads(_extract_json(content))
+    if not isinstance(addresses, list):
+        raise ValueError("地址提取结果不是JSON数组")
+    return [address for address in addresses if isinstance(address, dict)]
+
+
+def _salvage_addresses(content: str) -> List[Dict[str, Any]]:
+    """从被截断的地址数组中取出已完整生成的地址对象"""
+    addresses = []
+    for item in _JsonArrayItemParser().feed(content):
+        try:
+            address = _loads(item)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(address, dict):
+            addresses.append(address)
+    return addresses
+
+
+def _parse_order(content: str) -> List[int]:
+    """解析行程排序结果，结果不是JSON数组时抛出ValueError"""
+    order = _loads(_extract_json(content))
+    if not isinstance(order, list):
+        raise ValueError("行程排序结果不是JSON数组")
+    return order
+
+
+# 百炼服务地址（OpenAI兼容模式）
+BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+# 调用模型的超时时间（秒）及失败重试次数，非流式生成较长内容时可能需要数十秒
+REQUEST_TIMEOUT = 60.0
+MAX_RETRIES = 2
+
+# 进程内共享的异步OpenAI客户端，复用其中的连接池，首次使用时创建
+_client: Optional[AsyncOpenAI] = None
+
+
+def _get_client(api_key: Optional[str]) -> AsyncOpenAI:
+    """
+    获取共享的异步客户端，尚未创建或已被关闭时重新创建
+
+    API密钥在启动时读取一次，运行中不会变化，因此不需要按密钥区分客户端
+    """
+    global _client
+    if _client is None or _client.is_closed():
+        _client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=BASE_URL,
+            timeout=REQUEST_TIMEOUT,
+            max_retries=MAX_RETRIES,
+        )
+    return _client
+
+
+async def aclose_client() -> None:
+    """关闭共享的异步客户端，在应用退出时调用"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
 
 class QwenService:
     """阿里云百炼大模型服务封装 (OpenAI 兼容模式)"""
@@ -16,33 +280,193 @@ class QwenService:
         if not self.api_key:
             logger.warning("未设置DASHSCOPE_API_KEY环境变量，百炼服务将无法正常工作")
 
-        # 初始化OpenAI客户端
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
-
         # 设置默认模型
         self.model = "qwen-plus"  # 可选: qwen-max, qwen-turbo, qwen-plus 等
 
-    def _call_model(self, messages, temperature=0.7, max_tokens=1000):
-        """调用百炼API (OpenAI兼容模式)"""
+    @property
+    def client(self) -> AsyncOpenAI:
+        """
+        每次调用时获取进程内共享的异步OpenAI客户端
+
+        服务实例会被长期缓存，不持有客户端引用，客户端被aclose_client关闭后会重新创建
+        """
+        return _get_client(self.api_key)
+
+    def _cache_key(self, messages, temperature, max_tokens) -> str:
+        """根据模型、消息和参数生成响应缓存键"""
+        return SQLiteCache.build_key(self.model, messages, temperature, max_tokens)
+
+    @staticmethod
+    async def _cache_get(key: str, parse: Callable[[str], Any]) -> Any:
+        """读取缓存并用parse解析，未命中或缓存内容无法解析时返回None"""
+        cached = await _cache.aget(key)
+        if cached is None:
+            return None
         try:
-            completion = self.client.chat.completions.create(
+            result = parse(cached)
+        except ValueError as e:
+            logger.warning("缓存的模型响应无法解析，重新请求: %s", e)
+            return None
+        logger.info("模型响应命中缓存")
+        return result
+
+    async def _call_model(self, messages, parse: Callable[[str], Any], temperature=0.7, max_tokens=1000,
+                          use_cache=True, salvage: Optional[Callable[[str], Any]] = None):
+        """
+        调用百炼API (OpenAI兼容模式)，use_cache为False时跳过响应缓存
+
+        Args:
+            messages: 对话消息
+            parse: 解析模型返回内容的函数，内容无效时应抛出ValueError
+            temperature: 采样温度
+            max_tokens: 最大输出token数
+            use_cache: 是否读写响应缓存
+            salvage: 输出因达到max_tokens被截断时，从已生成的部分内容中取出可用结果的函数（可选）
+
+        Returns:
+            parse解析后的结果，调用或解析失败时返回None；只有完整且解析成功的结果才会写入缓存
+        """
+        key = self._cache_key(messages, temperature, max_tokens)
+        try:
+            if use_cache:
+                cached = await self._cache_get(key, parse)
+                if cached is not None:
+                    return cached
+
+            if _failed_recently(key):
+                logger.warning("相同请求近期调用失败，暂不重试")
+                return None
+
+            completion = await self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens,
             )
-
-            # 返回生成的内容
-            return completion.choices[0].message.content
+            choice = completion.choices[0]
+            content = choice.message.content
 
         except Exception as e:
-            logger.error(f"API调用出错: {str(e)}")
+            logger.error("API调用出错: %s", e)
+            _mark_failed(key)
             return None
 
-    def extract_addresses(self, text: str) -> List[Dict[str, Any]]:
+        if not content:
+            return None
+
+        if choice.finish_reason == 'length':
+            # 截断的输出无法完整解析，尽量保留已生成的部分，但不写入缓存
+            logger.warning("模型输出达到max_tokens=%d被截断", max_tokens)
+            return salvage(content) if salvage is not None else None
+
+        try:
+            result = parse(content)
+        except ValueError as e:
+            # 截断、格式错误等无效回复不写入缓存
+            logger.error("解析模型返回的JSON失败: %s, 内容: %s", e, content)
+            return None
+
+        if use_cache:
+            await _cache.aset(key, _dumps(result))
+        return result
+
+    @staticmethod
+    def _address_messages(text: str) -> List[Dict[str, str]]:
+        """构建地址提取的提示词消息，固定的规则放在系统消息中，便于服务端前缀缓存"""
+        return [
+            {"role": "system", "content": _ADDRESS_SYSTEM_PROMPT},
+            {"role": "user", "content": f"文本: {text}"}
+        ]
+
+    async def _stream_model(self, messages, temperature=0.7, max_tokens=1000) -> AsyncIterator[str]:
+        """以流式方式调用百炼API，逐段产出生成的内容，响应缓存由调用方在解析成功后写入"""
+        key = self._cache_key(messages, temperature, max_tokens)
+        if _failed_recently(key):
+            logger.warning("相同请求近期调用失败，暂不重试")
+            return
+
+        try:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+            )
+
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        except Exception:
+            _mark_failed(key)
+            raise
+
+    async def stream_addresses(self, text: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式提取地址，模型每生成完一个地址对象就立即产出，便于下游提前开始地理编码
+
+        Args:
+            text: 输入文本
+
+        Yields:
+            单个地址信息，结构与extract_addresses返回的元素一致
+        """
+        if _is_trivial_text(text):
+            return
+
+        messages = self._address_messages(text)
+        key = self._cache_key(messages, 0.2, ADDRESS_MAX_TOKENS)
+        cached = await self._cache_get(key, _parse_addresses)
+        if cached is not None:
+            for address in cached:
+                yield address
+            return
+
+        parser = _JsonArrayItemParser()
+        parts = []
+        addresses = []
+        complete = True
+        try:
+            async for delta in self._stream_model(
+                    messages=messages,
+                    temperature=0.2,
+                    max_tokens=ADDRESS_MAX_TOKENS
+            ):
+                parts.append(delta)
+                for item in parser.feed(delta):
+                    try:
+                        address = _loads(item)
+                    except json.JSONDecodeError as e:
+                        logger.warning("解析流式地址片段失败: %s, 内容: %s", e, item)
+                        complete = False
+                        continue
+                    if isinstance(address, dict):
+                        addresses.append(address)
+                        yield address
+        except Exception as e:
+            logger.error("流式地址提取过程中出错: %s", e)
+            return
+
+        if addresses:
+            # 只有完整且每个元素都解析成功的数组才写入缓存
+            if complete and parser.finished:
+                await _cache.aset(key, _dumps(addresses))
+            return
+
+        # 流式解析未得到任何地址时，按完整内容再解析一次
+        if parts:
+            content = ''.join(parts)
+            try:
+                addresses = _parse_addresses(content)
+            except ValueError as e:
+                logger.error("解析模型返回的JSON失败: %s, 内容: %s", e, content)
+                return
+            await _cache.aset(key, _dumps(addresses))
+            for address in addresses:
+                yield address
+
+    async def extract_addresses(self, text: str) -> List[Dict[str, Any]]:
         """
         从文本中提取并完善地址信息
 
@@ -52,67 +476,25 @@ class QwenService:
         Returns:
             提取的地址列表，每个地址包含完整的结构化信息
         """
-        try:
-            # 构建更智能的提示词
-            messages = [
-                {"role": "system",
-                 "content": """你是一个专业的地理信息提取助手，擅长从文本中识别和完善地址信息。
-                 请遵循以下规则：
-                 1. 默认假设所有地点都在同一城市内，除非文本明确提到不同城市
-                 2. 尽可能完善地址信息，添加省份、城市等缺失信息
-                 3. 推断地址所在城市，使用中国地名习惯
-                 4. 如果文本未明确指出城市，从上下文和地点特征推断最可能的城市
-                 5. 只返回JSON格式的结果，不要有其他解释"""},
-                {"role": "user", "content": f"""
-    请从以下文本中提取所有地址信息，并完善为尽可能完整的地址。每个地址应包含省份、城市、区县和详细地址。
-    返回格式应为JSON数组:
-    [
-      {{
-        "address": "完整地址文本",
-        "province": "省份",
-        "city": "城市",
-        "district": "区县",
-        "detail": "详细地址",
-        "time_mentioned": "相关时间信息(如有)",
-        "confidence": 0.9  // 地址识别置信度，0-1之间
-      }}
-    ]
-
-    文本: {text}
-    """}
-            ]
+        if _is_trivial_text(text):
+            return []
 
-            # 调用模型
-            content = self._call_model(
-                messages=messages,
+        try:
+            # 调用模型，返回内容解析失败时得到None
+            addresses = await self._call_model(
+                messages=self._address_messages(text),
+                parse=_parse_addresses,
                 temperature=0.2,
-                max_tokens=2000
+                max_tokens=ADDRESS_MAX_TOKENS,
+                salvage=_salvage_addresses
             )
-
-            if not content:
-                return []
-
-            # 尝试解析返回的JSON
-            try:
-                # 提取JSON部分
-                if "```json" in content:
-                    json_str = content.split("```json")[1].split("```")[0].strip()
-                elif "```" in content:
-                    json_str = content.split("```")[1].strip()
-                else:
-                    json_str = content
-
-                addresses = json.loads(json_str)
-                return addresses
-            except json.JSONDecodeError as e:
-                logger.error(f"解析模型返回的JSON失败: {str(e)}, 内容: {content}")
-                return []
+            return addresses or []
 
         except Exception as e:
-            logger.error(f"地址提取过程中出错: {str(e)}")
+            logger.error("地址提取过程中出错: %s", e)
             return []
 
-    def build_itinerary(self, locations: List[Dict[str, Any]], text: str = None) -> List[Dict[str, Any]]:
+    async def build_itinerary(self, locations: List[Dict[str, Any]], text: str = None) -> List[Dict[str, Any]]:
         """
         构建行程链，将地点按时间顺序排列
 
@@ -124,61 +506,41 @@ class QwenService:
             排序后的行程链
         """
         try:
-            # 如果只有一个地点或没有地点，直接返回
-            if len(locations) <= 1:
+            # 如果只有一个地点或没有地点，直接返回；两个地点且没有文本时按原顺序即可
+            if len(locations) <= 1 or (len(locations) == 2 and not text):
                 return locations
 
-            # 构建提示词
-            locations_json = json.dumps(locations, ensure_ascii=False)
+            # 构建提示词，只发送排序需要的字段
+            locations_json = _dumps([
+                {
+                    "index": i,
+                    "address": loc.get("address") or loc.get("formatted_address", ""),
+                    "city": loc.get("city", ""),
+                    "lnglat": [loc.get("longitude"), loc.get("latitude")],
+                    "time": loc.get("time_mentioned", "")
+                }
+                for i, loc in enumerate(locations)
+            ])
 
             # 构建消息
             messages = [
-                {"role": "system",
-                 "content": """你是一个专业的行程规划助手，擅长安排地点的访问顺序。
-                 请按照以下规则构建行程:
-                 1. 如果有明确的时间提及，按时间顺序排列
-                 2. 如果地点在不同城市，按照文本描述的顺序排列
-                 3. 如果在同一城市内，根据地理位置和合理的访问路线进行排序
-                 4. 考虑地址自然语言描述中的行程逻辑，比如"从A出发，经过B，最后到达C"
-                 5. 只返回JSON格式的结果，不要有其他解释"""},
-                {"role": "user", "content": f"""
-    请分析以下地点列表和原始文本，构建一个最合理的行程链:
-
-    地点列表: {locations_json}
-
-    原始文本描述: {text if text else "无文本描述"}
-
-    请返回完整的行程链JSON数组，排序后的地点序列应包含所有原始信息。
-    不要添加任何额外的说明或解释，只返回JSON数组。
-    """}
+                {"role": "system", "content": _ITINERARY_SYSTEM_PROMPT},
+                {"role": "user", "content": f"地点列表: {locations_json}\n原始文本描述: {text if text else '无文本描述'}"}
             ]
 
-            # 调用模型
-            content = self._call_model(
+            # 调用模型，返回内容解析失败时得到None
+            order = await self._call_model(
                 messages=messages,
+                parse=_parse_order,
                 temperature=0.2,
-                max_tokens=2000
+                max_tokens=ITINERARY_MAX_TOKENS
             )
 
-            if not content:
-                return locations
-
-            # 尝试解析返回的JSON
-            try:
-                # 提取JSON部分
-                if "```json" in content:
-                    json_str = content.split("```json")[1].split("```")[0].strip()
-                elif "```" in content:
-                    json_str = content.split("```")[1].strip()
-                else:
-                    json_str = content
-
-                itinerary = json.loads(json_str)
-                return itinerary
-            except json.JSONDecodeError as e:
-                logger.error(f"解析行程排序JSON失败: {str(e)}, 内容: {content}")
+            if order is None:
                 return locations  # 出错时返回原始列表
 
+            return _apply_order(locations, order)
+
         except Exception as e:
-            logger.error(f"构建行程链过程中出错: {str(e)}")
+            logger.error("构建行程链过程中出错: %s", e)
             return locations  # 出错时返回原始列表
\ No newline at end of file
@@ -0,0 +1,26 @@
+import re
+from datetime import datetime
+from typing import Any, Optional
+
+# 匹配 "2023:05:20 14:35:42"（EXIF格式）或 "2023-05-20 14:35:42" 等时间字符串
+_EXIF_DT_RE = re.compile(r'(\d{4})[:\-](\d{2})[:\-](\d{2})[ T](\d{2}):(\d{2}):(\d{2})')
+
+
+def parse_exif_datetime(value: Any) -> Optional[datetime]:
+    """
+    解析EXIF时间字符串
+
+    Args:
+        value: 时间值，会先转换为字符串
+
+    Returns:
+        解析得到的datetime，无法解析时返回None
+    """
+    m = _EXIF_DT_RE.match(str(value))
+    if not m:
+        return None
+    try:
+        return datetime(*map(int, m.groups()))
+    except ValueError:
+        # 格式正确但数值越界，如月份为00
+        return None
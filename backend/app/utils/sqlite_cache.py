@@ -0,0 +1,133 @@
+import json
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import hashlib
+from typing import Any, Optional
+
+try:
+    import xxhash
+except ImportError:  # 未安装xxhash时使用标准库的blake2b
+    xxhash = None
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteCache:
+    """
+    基于SQLite的持久化键值缓存，用于大模型响应和地理编码结果等
+
+    ttl为默认的过期时间（秒），None表示不过期；max_rows为最多保留的条数，
+    超出时按写入时间淘汰最旧的记录，None表示不限制
+
+    多个工作进程共享同一个缓存文件，在异步代码中请使用aget/aset，在线程池中执行查询，不阻塞事件循环
+    """
+
+    # 每写入多少次检查一次过期记录和条数上限，避免每次写入都扫描表
+    PRUNE_INTERVAL = 64
+    # 其他连接持有锁时的最长等待时间（秒），缓存读写失败时直接按未命中处理
+    BUSY_TIMEOUT = 0.2
+
+    def __init__(self, path: str, ttl: Optional[float] = None, max_rows: Optional[int] = None):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=self.BUSY_TIMEOUT)
+        try:
+            # WAL模式下读写互不阻塞，多个工作进程并发访问时只有写入之间需要等待
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.Error as e:
+            logger.warning("启用缓存WAL模式失败: %s", e)
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL)"
+            )
+            # 兼容旧版本创建的没有过期时间列的缓存表
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cache)")}
+            if 'expires_at' not in columns:
+                try:
+                    self._conn.execute("ALTER TABLE cache ADD COLUMN expires_at REAL")
+                except sqlite3.OperationalError:
+                    # 其他工作进程已同时完成迁移
+                    pass
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_created_at ON cache (created_at)")
+            self._prune()
+
+    @staticmethod
+    def build_key(*parts: Any) -> str:
+        """
+        根据请求内容生成缓存键，任何一部分（模型、消息、参数）变化都会得到不同的键
+
+        Args:
+            parts: 可JSON序列化的请求内容
+
+        Returns:
+            十六进制哈希字符串
+        """
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        # 缓存键只用于内部查找，不需要密码学强度，使用更快的非加密哈希
+        if xxhash is not None:
+            return xxhash.xxh3_64_hexdigest(payload)
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中、已过期或出错时返回None"""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    (key, time.time())
+                ).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            logger.warning("读取缓存失败: %s", e)
+            return None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """
+        写入缓存，出错时只记录日志
+
+        Args:
+            key: 缓存键
+            value: 缓存内容
+            ttl: 本条记录的过期时间（秒），为None时使用创建缓存时的默认值
+        """
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl is not None else None
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, expires_at)
+                )
+                self._writes += 1
+                if self._writes % self.PRUNE_INTERVAL == 0:
+                    self._prune()
+        except sqlite3.Error as e:
+            logger.warning("写入缓存失败: %s", e)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """在线程池中执行get，供异步代码调用"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, key)
+
+    async def aset(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """在线程池中执行set，供异步代码调用"""
+        await asyncio.get_running_loop().run_in_executor(None, self.set, key, value, ttl)
+
+    def _prune(self) -> None:
+        """删除过期记录，并按写入时间淘汰超出条数上限的旧记录，调用方需持有锁"""
+        self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        if self.max_rows is not None:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY created_at DESC, rowid DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,)
+            )
@@ -1,14 +1,32 @@
 import os
+import asyncio
 import logging
-from typing import List
-from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 import uvicorn
 from dotenv import load_dotenv
-from app.services.qwen_service import QwenService
-from app.services.amap_service import AMapService
-from app.core.image_processor import ImageProcessor
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.targets import BaseTarget
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时使用标准库序列化响应
+    orjson = None
+
+# 加载环境变量（需在导入服务模块之前，模块级的缓存配置会读取环境变量）
+load_dotenv()
+
+from app.services.qwen_service import QwenService, aclose_client as aclose_qwen_client
+from app.services.amap_service import AMapService, aclose_client as aclose_amap_client
+from app.core.image_processor import ImageProcessor, JPEG_SOI, MAGIC_LENGTH, is_exif_capable, jpeg_header_length
 from app.core.text_processor import TextProcessor
 
 # 配置日志
@@ -18,39 +36,217 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 加载环境变量
-load_dotenv()
-
 # 打印环境变量（调试用）
 print(f"DASHSCOPE_API_KEY设置状态: {'已设置' if os.getenv('DASHSCOPE_API_KEY') else '未设置'}")
 print(f"AMAP_API_KEY设置状态: {'已设置' if os.getenv('AMAP_API_KEY') else '未设置'}")
 
-# 创建FastAPI应用
-app = FastAPI(title="智能地理信息提取与可视化系统")
 
-# 配置CORS
+# Web工作进程数：python main.py读取WEB_WORKERS，uvicorn命令行未指定--workers时读取WEB_CONCURRENCY
+WEB_WORKERS = int(os.getenv('WEB_WORKERS') or os.getenv('WEB_CONCURRENCY') or '1')
+# 每个Web工作进程中解析图片EXIF的进程数，默认由各工作进程平分CPU核数，避免进程数成倍增长
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '0')) or max(1, (os.cpu_count() or 1) // WEB_WORKERS)
+# 同时读取和解析的图片数上限，避免一次上传大量图片时内存和进程池任务堆积
+IMAGE_CONCURRENCY = max(8, IMAGE_WORKERS * 2)
+
+
+def _mp_context():
+    """
+    进程池使用的启动方式：优先forkserver，不支持的平台（如Windows）使用spawn
+
+    uvicorn工作进程中已有线程在运行，直接fork可能使子进程死锁，
+    forkserver从启动时的干净进程中fork子进程，并预先导入图片解析模块
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['app.core.image_processor'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+class CpuPool:
+    """EXIF解析使用的进程池，工作进程意外退出导致进程池损坏时自动重建"""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._mp_context = _mp_context()
+        self._executor = self._create_executor()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self._mp_context)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        在进程池中执行fn，不阻塞事件循环
+
+        进程池损坏时替换为新的进程池后重新抛出BrokenProcessPool，
+        不重试当前任务，避免导致工作进程崩溃的图片反复破坏新进程池
+        """
+        executor = self._executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # 并发任务会同时收到该异常，只由第一个任务重建
+            if self._executor is executor:
+                logger.error("图片解析进程池已损坏，重新创建进程池")
+                self._executor = self._create_executor()
+                executor.shutdown(wait=False)
+            raise
+
+    def shutdown(self) -> None:
+        self._executor.shutdown()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # EXIF解析是CPU密集型任务，放到进程池中执行，不阻塞事件循环；在处理任何请求之前创建
+    app.state.cpu_pool = CpuPool(max_workers=IMAGE_WORKERS)
+    # 信号量需在事件循环中创建（Python 3.10以前会绑定创建时的事件循环）
+    app.state.image_semaphore = asyncio.Semaphore(IMAGE_CONCURRENCY)
+    yield
+    app.state.cpu_pool.shutdown()
+    # 关闭共享的高德HTTP连接池和百炼客户端
+    await aclose_amap_client()
+    await aclose_qwen_client()
+
+
+# 响应类：优先使用orjson序列化，地图数据和位置列表较大时明显更快
+APIResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+# 创建FastAPI应用
+app = FastAPI(title="智能地理信息提取与可视化系统", lifespan=lifespan, default_response_class=APIResponse)
+
+# 配置CORS：允许的前端域名从ALLOWED_ORIGINS读取（逗号分隔），默认为本地开发服务器
+ALLOWED_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv('ALLOWED_ORIGINS', 'http://localhost:5173,http://127.0.0.1:5173').split(',')
+    if origin.strip()
+]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # 生产环境中应该限制为前端域名
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=ALLOWED_ORIGINS,
+    # 通配符域名不能与凭据同时使用（CORS规范要求）
+    allow_credentials="*" not in ALLOWED_ORIGINS,
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type"],
 )
 
+# 压缩较大的响应（位置列表、地图和路线数据），后添加的中间件在外层
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 
-# 依赖项
+# 依赖项：服务对象无状态，进程内共享单例，复用其中的HTTP连接池
+@lru_cache(maxsize=1)
 def get_qwen_service():
     return QwenService()
 
 
+@lru_cache(maxsize=1)
 def get_amap_service():
     return AMapService()
 
 
+@lru_cache(maxsize=1)
 def get_image_processor():
     return ImageProcessor()
 
 
+def get_cpu_pool(request: Request) -> CpuPool:
+    return request.app.state.cpu_pool
+
+
+def get_image_semaphore(request: Request) -> asyncio.Semaphore:
+    return request.app.state.image_semaphore
+
+
+# 分块读取上传图片时每次读取的字节数
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# 批量上传时每张图片在内存中最多保留的字节数（足以容纳EXIF），超出部分直接丢弃
+MAX_PART_BYTES = 256 * 1024
+# 批量上传时已接收但尚未解析完成的图片数据总量上限，超出时暂停读取请求体
+MAX_BUFFERED_BYTES = IMAGE_CONCURRENCY * MAX_PART_BYTES
+
+
+async def read_image_data(file: UploadFile) -> bytes:
+    """
+    分块读取上传的图片，JPEG读到文件头（含EXIF和尺寸信息）结束即停止，不读取其后的像素数据
+
+    Args:
+        file: 上传的图片文件
+
+    Returns:
+        JPEG为文件头部分的数据，不支持EXIF的格式只返回开头的数据，其他格式为完整数据
+    """
+    head = await file.read(UPLOAD_CHUNK_SIZE)
+    if not is_exif_capable(head):
+        return head
+    if not head.startswith(JPEG_SOI):
+        return head + await file.read()
+
+    buf = bytearray(head)
+    while jpeg_header_length(buf) is None:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        buf += chunk
+    return bytes(buf)
+
+
+class ImageHeaderTarget(BaseTarget):
+    """
+    multipart流式解析的接收目标，依次接收同名字段下的多张图片
+
+    JPEG只保留文件头（含EXIF和尺寸信息），不支持EXIF的格式只保留开头的魔数，其余数据直接丢弃；
+    每张图片最多保留MAX_PART_BYTES字节，接收完成时调用on_image
+    """
+
+    def __init__(self, on_image: Callable[[str, bytes, int], None]):
+        super().__init__()
+        self._on_image = on_image
+        self._buf = bytearray()
+        self._size = 0
+        self._header_done = False
+        self._truncated = False
+
+    def on_start(self):
+        self._buf = bytearray()
+        self._size = 0
+        self._header_done = False
+        self._truncated = False
+
+    def on_data_received(self, chunk: bytes):
+        self._size += len(chunk)
+        if self._header_done:
+            return
+
+        self._buf += chunk
+        if len(self._buf) >= MAGIC_LENGTH and not is_exif_capable(self._buf):
+            del self._buf[MAGIC_LENGTH:]
+            self._header_done = True
+        elif self._buf.startswith(JPEG_SOI):
+            end = jpeg_header_length(self._buf)
+            if end is not None:
+                del self._buf[end:]
+                self._header_done = True
+
+        # PNG、TIFF、WebP及找不到SOS的JPEG只保留开头部分，避免整张图片驻留内存
+        if len(self._buf) > MAX_PART_BYTES:
+            del self._buf[MAX_PART_BYTES:]
+            self._header_done = True
+            self._truncated = True
+
+    def on_finish(self):
+        if self._truncated:
+            logger.warning("图片 %s 超过%d字节，只解析开头部分", self.multipart_filename, MAX_PART_BYTES)
+        self._on_image(self.multipart_filename, bytes(self._buf), self._size)
+
+
+def upload_size(file: UploadFile, image_data: bytes) -> int:
+    """上传文件的实际大小，只读取了文件头时也能正确记录"""
+    return file.size if file.size is not None else len(image_data)
+
+
+# 以同一对服务对象为键缓存，依赖项本身是单例，因此也只会创建一次
+@lru_cache(maxsize=1)
 def get_text_processor(
         qwen_service: QwenService = Depends(get_qwen_service),
         amap_service: AMapService = Depends(get_amap_service)
@@ -67,29 +263,35 @@ async def root():
 async def process_image(
         file: UploadFile = File(...),
         image_processor: ImageProcessor = Depends(get_image_processor),
-        amap_service: AMapService = Depends(get_amap_service)
+        amap_service: AMapService = Depends(get_amap_service),
+        cpu_pool: CpuPool = Depends(get_cpu_pool)
 ):
     """处理上传的图片，提取地理位置信息"""
     try:
-        # 读取图片数据
-        image_data = await file.read()
+        # 读取图片数据（JPEG只读取文件头）
+        image_data = await read_image_data(file)
 
         # 记录图片信息
-        logger.info(f"接收到图片：{file.filename}，大小：{len(image_data)} 字节")
+        logger.info(f"接收到图片：{file.filename}，大小：{upload_size(file, image_data)} 字节")
+
+        # 不支持EXIF的格式无需解析
+        if not is_exif_capable(image_data):
+            logger.warning(f"图片 {file.filename} 的格式不支持EXIF")
+            return APIResponse(
+                status_code=200,
+                content={"success": False, "message": "图片格式不支持EXIF，未能提取到GPS信息"}
+            )
 
-        # 提取GPS信息
-        gps_info = image_processor.extract_gps_from_image(image_data)
+        # 提取GPS信息和图片基本信息（图片只解析一次，在进程池中执行）
+        gps_info, image_info = await cpu_pool.run(image_processor.extract_all, image_data)
 
         if not gps_info:
             logger.warning(f"图片 {file.filename} 未能提取到GPS信息")
-            return JSONResponse(
+            return APIResponse(
                 status_code=200,
                 content={"success": False, "message": "未能从图片中提取到GPS信息"}
             )
 
-        # 获取图片基本信息
-        image_info = image_processor.get_image_info(image_data)
-
         # 记录成功提取的信息
         logger.info(f"成功从图片 {file.filename} 提取到GPS信息：{gps_info}")
 
@@ -97,7 +299,7 @@ async def process_image(
         static_map_url = amap_service.get_static_map([gps_info])
 
         # 准备地图数据
-        map_data = amap_service.prepare_map_data([gps_info])
+        map_data = await amap_service.prepare_map_data([gps_info])
 
         return {
             "success": True,
@@ -108,11 +310,9 @@ async def process_image(
             "map_data": map_data
         }
     except Exception as e:
-        # 详细记录异常
-        logger.error(f"处理图片 {file.filename if file else 'unknown'} 时出错: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
-        return JSONResponse(
+        # 详细记录异常（含调用栈）
+        logger.exception("处理图片 %s 时出错: %s", file.filename if file else 'unknown', e)
+        return APIResponse(
             status_code=500,
             content={"success": False, "message": f"处理图片时出错: {str(e)}"}
         )
@@ -127,64 +327,119 @@ async def process_text(
     """处理文本，提取地址信息"""
     try:
         # 处理文本
-        result = text_processor.process_text(text)
+        result = await text_processor.process_text(text)
 
         # 如果处理成功，添加地图数据
         if result.get("success") and result.get("itinerary"):
-            map_data = amap_service.prepare_map_data(result["itinerary"])
+            # 复用process_text中已规划的路径，避免重复请求
+            map_data = await amap_service.prepare_map_data(result["itinerary"], route_data=result.get("route"))
             result["map_data"] = map_data
 
         return result
     except Exception as e:
         logger.error(f"处理文本时出错: {str(e)}")
-        return JSONResponse(
+        return APIResponse(
             status_code=500,
             content={"success": False, "message": f"处理文本时出错: {str(e)}"}
         )
 
 
-@app.post("/process-images")
+# /process-images直接解析请求体，手动声明请求格式以保留接口文档
+_PROCESS_IMAGES_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["files"],
+                    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}}
+                }
+            }
+        }
+    }
+}
+
+
+@app.post("/process-images", openapi_extra=_PROCESS_IMAGES_BODY)
 async def process_images(
-        files: List[UploadFile] = File(...),
+        request: Request,
         image_processor: ImageProcessor = Depends(get_image_processor),
         amap_service: AMapService = Depends(get_amap_service),
-        text_processor: TextProcessor = Depends(get_text_processor)
+        text_processor: TextProcessor = Depends(get_text_processor),
+        cpu_pool: CpuPool = Depends(get_cpu_pool),
+        image_semaphore: asyncio.Semaphore = Depends(get_image_semaphore)
 ):
     """处理多张图片，提取地理位置信息并构建行程链"""
     try:
-        # 记录请求信息
-        logger.info(f"收到批量处理请求，共{len(files)}张图片")
-
-        # 存储所有图片的位置信息
-        locations = []
-
-        # 处理每张图片
-        for file in files:
-            image_data = await file.read()
-            logger.info(f"处理图片: {file.filename}, 大小: {len(image_data)}字节")
-
-            # 提取GPS信息
-            gps_info = image_processor.extract_gps_from_image(image_data)
+        async def load_location(filename: str, image_data: bytes, size: int) -> Optional[Dict[str, Any]]:
+            """在进程池中解析单张图片的EXIF，未提取到GPS信息时返回None"""
+            logger.info(f"处理图片: {filename}, 大小: {size}字节")
+            if not is_exif_capable(image_data):
+                logger.warning(f"图片 {filename} 的格式不支持EXIF")
+                return None
+
+            # 所有请求共享并发上限，超出时排队等待
+            async with image_semaphore:
+                # 提取GPS信息和图片基本信息(包含时间信息)，图片只解析一次
+                gps_info, image_info = await cpu_pool.run(image_processor.extract_all, image_data)
             if not gps_info:
-                logger.warning(f"图片 {file.filename} 未能提取到GPS信息")
-                continue
-
-            # 获取图片基本信息(包含时间信息)
-            image_info = image_processor.get_image_info(image_data)
+                logger.warning(f"图片 {filename} 未能提取到GPS信息")
+                return None
 
             # 构建位置信息
-            location = {
+            return {
                 **gps_info,
                 **image_info,
-                "filename": file.filename,
-                "name": file.filename,  # 添加名称用于地图标记
+                "filename": filename,
+                "name": filename,  # 添加名称用于地图标记
                 "address": gps_info.get("formatted_address", "未知地点")
             }
 
-            locations.append(location)
+        # 流式解析multipart请求体，不经过临时文件；每张图片接收完成即开始解析，与后续上传重叠进行
+        # 每项为(文件名, 解析任务, 内存中保留的字节数)
+        pending: List[Tuple[str, "asyncio.Future", int]] = []
+
+        def on_image(filename: str, image_data: bytes, size: int):
+            task = asyncio.ensure_future(load_location(filename, image_data, size))
+            pending.append((filename, task, len(image_data)))
+
+        def buffered_bytes() -> int:
+            return sum(nbytes for _, task, nbytes in pending if not task.done())
+
+        parser = StreamingFormDataParser(headers=request.headers)
+        parser.register("files", ImageHeaderTarget(on_image))
+        try:
+            async for chunk in request.stream():
+                parser.data_received(chunk)
+                # 等待解析的图片数据过多时暂停读取请求体，解析完成的图片释放内存后再继续
+                while buffered_bytes() > MAX_BUFFERED_BYTES:
+                    await asyncio.wait(
+                        [task for _, task, _ in pending if not task.done()],
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+        except BaseException:
+            # 请求体解析失败或请求被取消时取消已开始的图片解析
+            for _, task, _ in pending:
+                task.cancel()
+            raise
+
+        # 记录请求信息
+        logger.info(f"收到批量处理请求，共{len(pending)}张图片")
+
+        # 等待所有图片处理完成，结果保持上传顺序
+        results = await asyncio.gather(*(task for _, task, _ in pending), return_exceptions=True)
+
+        # 存储所有图片的位置信息
+        locations = []
+        for (filename, _, _), result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.error("处理图片 %s 时出错: %s", filename, result, exc_info=result)
+            elif result:
+                locations.append(result)
 
         if not locations:
-            return JSONResponse(
+            return APIResponse(
                 status_code=200,
                 content={
                     "success": False,
@@ -195,33 +450,8 @@ async def process_images(
         # 按照时间排序(如果存在时间信息)
         sorted_locations = text_processor.sort_locations_by_time(locations)
 
-        # 生成行程路线
-        route_data = None
-        if len(sorted_locations) >= 2:
-            # 准备起点、终点和途经点
-            origin = f"{sorted_locations[0]['longitude']},{sorted_locations[0]['latitude']}"
-            destination = f"{sorted_locations[-1]['longitude']},{sorted_locations[-1]['latitude']}"
-
-            waypoints = None
-            if len(sorted_locations) > 2:
-                waypoint_list = []
-                for loc in sorted_locations[1:-1]:
-                    waypoint_list.append(f"{loc['longitude']},{loc['latitude']}")
-                waypoints = ";".join(waypoint_list)
-
-            # 规划路径
-            route_data = amap_service.plan_route(
-                origin=origin,
-                destination=destination,
-                waypoints=waypoints
-            )
-
-        # 准备地图数据
-        map_data = amap_service.prepare_map_data(sorted_locations)
-
-        # 如果有路径数据，添加到地图数据中
-        if route_data:
-            map_data["routeData"] = route_data
+        # 准备地图数据，多个位置点时其中会按排序后的顺序规划一次路径
+        map_data = await amap_service.prepare_map_data(sorted_locations)
 
         return {
             "success": True,
@@ -231,13 +461,22 @@ async def process_images(
         }
 
     except Exception as e:
-        logger.error(f"批量处理图片出错: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
-        return JSONResponse(
+        logger.exception("批量处理图片出错: %s", e)
+        return APIResponse(
             status_code=500,
             content={"success": False, "message": f"处理图片时出错: {str(e)}"}
         )
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # 开发时设置UVICORN_RELOAD=1开启热重载（只能单进程）；否则按WEB_WORKERS启动多个工作进程
+    # 安装了uvloop和httptools时uvicorn会自动使用
+    reload = os.getenv('UVICORN_RELOAD') == '1'
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=reload,
+        workers=None if reload else WEB_WORKERS,
+        limit_concurrency=int(os.getenv('WEB_LIMIT_CONCURRENCY', '512')),
+        backlog=2048,
+    )
\ No newline at end of file
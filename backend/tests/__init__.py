@@ -0,0 +1,5 @@
+import os
+
+# 测试使用内存中的缓存，避免读写工作目录下的缓存文件
+os.environ.setdefault('QWEN_CACHE_PATH', ':memory:')
+os.environ.setdefault('AMAP_CACHE_PATH', ':memory:')
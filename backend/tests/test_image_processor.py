@@ -0,0 +1,156 @@
+"""EXIF快速解析与Pillow解析结果的一致性测试"""
+import struct
+import unittest
+from io import BytesIO
+
+from PIL import Image
+
+from app.core import image_processor as ip
+
+
+DATETIME = 0x0132
+MAKE = 0x010F
+DATETIME_ORIGINAL = 0x9003
+ASCII, SHORT, LONG, RATIONAL, IFD = 2, 3, 4, 5, 13
+
+
+def _build_tiff(endian: str, gps: bool = True, pointer_type: int = LONG) -> bytes:
+    """按给定字节序手工构造包含IFD0、Exif子IFD和（可选）GPS子IFD的TIFF数据"""
+    order = b'II' if endian == '<' else b'MM'
+    data_area = bytearray()
+
+    def layout(entries, start):
+        """将(标签, 类型, 个数, 值字节)写成IFD，超过4字节的值放到数据区"""
+        ifd = struct.pack(endian + 'H', len(entries))
+        base = start + 2 + 12 * len(entries) + 4
+        extra = bytearray()
+        for tag, field_type, count, raw in sorted(entries):
+            if len(raw) <= 4:
+                value = raw.ljust(4, b'\0')
+            else:
+                value = struct.pack(endian + 'I', base + len(extra))
+                extra += raw
+            ifd += struct.pack(endian + 'HHI', tag, field_type, count) + value
+        return ifd + struct.pack(endian + 'I', 0) + bytes(extra)
+
+    def rationals(*pairs):
+        return b''.join(struct.pack(endian + 'II', n, d) for n, d in pairs)
+
+    def ascii_(text):
+        return text.encode('ascii') + b'\0'
+
+    exif_entries = [(DATETIME_ORIGINAL, ASCII, 20, ascii_('2023:05:21 10:00:00'))]
+    gps_entries = [
+        (ip.GPS_LAT_REF, ASCII, 2, ascii_('N')),
+        (ip.GPS_LAT, RATIONAL, 3, rationals((39, 1), (54, 1), (275, 10))),
+        (ip.GPS_LON_REF, ASCII, 2, ascii_('E')),
+        (ip.GPS_LON, RATIONAL, 3, rationals((116, 1), (23, 1), (504, 10))),
+    ]
+
+    # 先确定各IFD的长度，再回填子IFD偏移量
+    def ifd0_entries(exif_offset, gps_offset):
+        entries = [
+            (MAKE, ASCII, 6, ascii_('Canon')),
+            (DATETIME, ASCII, 20, ascii_('2023:05:20 14:35:42')),
+            (ip.EXIF_IFD_TAG, pointer_type, 1, struct.pack(endian + 'I', exif_offset)),
+        ]
+        if gps:
+            entries.append((ip.GPS_IFD_TAG, pointer_type, 1, struct.pack(endian + 'I', gps_offset)))
+        return entries
+
+    ifd0_len = len(layout(ifd0_entries(0, 0), 8))
+    exif_offset = 8 + ifd0_len
+    exif_ifd = layout(exif_entries, exif_offset)
+    gps_offset = exif_offset + len(exif_ifd)
+    gps_ifd = layout(gps_entries, gps_offset) if gps else b''
+
+    data_area += layout(ifd0_entries(exif_offset, gps_offset), 8) + exif_ifd + gps_ifd
+    return order + struct.pack(endian + 'HI', 42, 8) + bytes(data_area)
+
+
+def _build_jpeg(tiff: bytes, declared_length: int = None) -> bytes:
+    """将TIFF数据作为APP1段插入到Pillow生成的JPEG文件头之后"""
+    buffer = BytesIO()
+    Image.new('RGB', (16, 12)).save(buffer, 'JPEG')
+    jpeg = buffer.getvalue()
+    payload = ip._EXIF_HEADER + tiff
+    length = declared_length if declared_length is not None else len(payload) + 2
+    app1 = b'\xff\xe1' + struct.pack('>H', length) + payload
+    return jpeg[:2] + app1 + jpeg[2:]
+
+
+def _pillow_exif(data: bytes):
+    with Image.open(BytesIO(data)) as img:
+        return ip._read_exif(img)
+
+
+def _normalize(exif):
+    """只保留快速解析关心的标签，并把IFDRational统一转换为浮点数"""
+    if exif is None:
+        return None
+    result = {}
+    for tag in ip._IFD0_WANTED - {ip.EXIF_IFD_TAG}:
+        if tag not in exif:
+            continue
+        value = exif[tag]
+        if tag == ip.GPS_IFD_TAG:
+            value = {
+                k: tuple(float(x) for x in v) if isinstance(v, tuple) else v
+                for k, v in value.items() if k in ip._GPS_IFD_WANTED
+            }
+        result[tag] = value
+    return result
+
+
+class ReadJpegExifTest(unittest.TestCase):
+
+    def assert_matches_pillow(self, data: bytes):
+        fast = ip._read_jpeg_exif(data)
+        self.assertIsNotNone(fast)
+        self.assertEqual(_normalize(fast), _normalize(_pillow_exif(data)))
+        return fast
+
+    def test_little_endian(self):
+        fast = self.assert_matches_pillow(_build_jpeg(_build_tiff('<')))
+        self.assertEqual(fast[DATETIME_ORIGINAL], '2023:05:21 10:00:00')
+        self.assertIn(ip.GPS_IFD_TAG, fast)
+
+    def test_big_endian(self):
+        fast = self.assert_matches_pillow(_build_jpeg(_build_tiff('>')))
+        self.assertEqual(fast[ip.GPS_IFD_TAG][ip.GPS_LON_REF], 'E')
+
+    def test_ifd_type_pointers(self):
+        for endian in ('<', '>'):
+            with self.subTest(endian=endian):
+                fast = self.assert_matches_pillow(_build_jpeg(_build_tiff(endian, pointer_type=IFD)))
+                self.assertEqual(fast[DATETIME_ORIGINAL], '2023:05:21 10:00:00')
+                self.assertIn(ip.GPS_IFD_TAG, fast)
+
+    def test_missing_gps_ifd(self):
+        fast = self.assert_matches_pillow(_build_jpeg(_build_tiff('<', gps=False)))
+        self.assertNotIn(ip.GPS_IFD_TAG, fast)
+
+    def test_unfollowable_pointer_falls_back(self):
+        # 类型为SHORT且个数为2的指针无法作为偏移量，交给Pillow处理
+        data = _build_jpeg(_build_tiff('<', pointer_type=SHORT).replace(
+            struct.pack('<HHI', ip.EXIF_IFD_TAG, SHORT, 1),
+            struct.pack('<HHI', ip.EXIF_IFD_TAG, SHORT, 2)))
+        self.assertIsNone(ip._read_jpeg_exif(data))
+
+    def test_truncated_app1(self):
+        tiff = _build_tiff('<')
+        # APP1声明的长度超出实际数据
+        self.assertIsNone(ip._read_jpeg_exif(_build_jpeg(tiff, declared_length=len(tiff) + 1000)[:len(tiff) + 20]))
+        # APP1长度正确，但TIFF数据被截断，子IFD偏移量越界
+        self.assertIsNone(ip._read_jpeg_exif(_build_jpeg(tiff[:60])))
+
+    def test_extract_all_with_ifd_type_pointers(self):
+        data = _build_jpeg(_build_tiff('>', pointer_type=IFD))
+        gps, info = ip.ImageProcessor().extract_all(data)
+        self.assertIsNotNone(gps)
+        self.assertAlmostEqual(gps['latitude'], 39 + 54 / 60 + 27.5 / 3600, places=6)
+        self.assertEqual(info['formatted_time'], '2023-05-21 10:00:00')
+
+
+if __name__ == '__main__':
+    unittest.main()
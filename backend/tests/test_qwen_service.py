@@ -0,0 +1,108 @@
+"""百炼服务返回内容解析的测试"""
+import asyncio
+import types
+import unittest
+from unittest import mock
+
+from app.services import qwen_service
+from app.services.qwen_service import QwenService, _JsonArrayItemParser, _extract_json
+
+
+def _feed_all(text, chunk_size=3):
+    """按固定大小分段输入，模拟流式到达的内容"""
+    parser = _JsonArrayItemParser()
+    items = []
+    for start in range(0, len(text), chunk_size):
+        items.extend(parser.feed(text[start:start + chunk_size]))
+    return parser, items
+
+
+class JsonArrayItemParserTest(unittest.TestCase):
+
+    def test_items_split_across_chunks(self):
+        parser, items = _feed_all('[{"address": "北京"}, {"address": "上海"}]')
+        self.assertEqual(items, ['{"address": "北京"}', '{"address": "上海"}'])
+        self.assertTrue(parser.finished)
+
+    def test_brackets_and_escapes_in_strings(self):
+        text = r'[{"address": "A座]{1}", "detail": "引号\"[内]\"和\\"}, {"address": "B"}]'
+        parser, items = _feed_all(text)
+        self.assertEqual(items, [r'{"address": "A座]{1}", "detail": "引号\"[内]\"和\\"}', '{"address": "B"}'])
+        self.assertTrue(parser.finished)
+
+    def test_nested_arrays(self):
+        parser, items = _feed_all('[{"lnglat": [1, 2]}, [3, [4]]]', chunk_size=1)
+        self.assertEqual(items, ['{"lnglat": [1, 2]}', '[3, [4]]'])
+
+    def test_truncated_array(self):
+        parser, items = _feed_all('[{"address": "北京"}, {"address": "上')
+        self.assertEqual(items, ['{"address": "北京"}'])
+        self.assertFalse(parser.finished)
+
+    def test_prose_and_fence_before_array(self):
+        parser, items = _feed_all('好的，结果如下：\n```json\n[{"address": "北京"}]\n```\n以上')
+        self.assertEqual(items, ['{"address": "北京"}'])
+        self.assertTrue(parser.finished)
+
+    def test_brackets_in_prose_before_array(self):
+        parser, items = _feed_all('结果[共2个]如下：```json\n[{"a": 1}, {"b": 2}]\n```')
+        self.assertEqual(items, ['{"a": 1}', '{"b": 2}'])
+        self.assertTrue(parser.finished)
+
+    def test_content_after_array_is_ignored(self):
+        parser = _JsonArrayItemParser()
+        self.assertEqual(parser.feed('[{"a": 1}] [{"b": 2}]'), ['{"a": 1}'])
+        self.assertEqual(parser.feed('{"c": 3}]'), [])
+
+
+
+class ExtractJsonTest(unittest.TestCase):
+
+    def test_fenced_block_wins_over_brackets_before_it(self):
+        self.assertEqual(_extract_json('结果[共2个]如下：```json\n[{"a":1}]\n```'), '[{"a":1}]')
+
+    def test_fence_without_language(self):
+        self.assertEqual(_extract_json('```\n{"a": [1, 2]}\n```'), '{"a": [1, 2]}')
+
+    def test_first_of_several_fenced_blocks(self):
+        self.assertEqual(_extract_json('```json\n[1]\n```\n另见\n```json\n[2]\n```'), '[1]')
+
+    def test_bare_json_without_fence(self):
+        self.assertEqual(_extract_json('排序结果：[2, 0, 1]。'), '[2, 0, 1]')
+        self.assertEqual(_extract_json('[{"a": [1]}]'), '[{"a": [1]}]')
+
+    def test_no_json(self):
+        self.assertEqual(_extract_json('无法识别'), '无法识别')
+
+
+
+def _fake_client(content, finish_reason):
+    """返回固定内容的非流式OpenAI客户端"""
+    async def create(**kwargs):
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message, finish_reason=finish_reason)])
+    return types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+
+
+class ExtractAddressesTest(unittest.TestCase):
+
+    def extract(self, text, content, finish_reason):
+        with mock.patch.object(qwen_service, '_get_client', return_value=_fake_client(content, finish_reason)):
+            return asyncio.run(QwenService().extract_addresses(text))
+
+    def test_truncated_output_keeps_complete_addresses(self):
+        content = '```json\n[{"address": "北京"}, {"address": "上海"}, {"address": "广'
+        self.assertEqual(self.extract('北京上海广州', content, 'length'), [{"address": "北京"}, {"address": "上海"}])
+
+    def test_truncated_output_is_not_cached(self):
+        content = '[{"address": "杭州"}, {"address": "苏'
+        self.extract('杭州苏州', content, 'length')
+        self.assertEqual(self.extract('杭州苏州', '[{"address": "杭州"}, {"address": "苏州"}]', 'stop'),
+                         [{"address": "杭州"}, {"address": "苏州"}])
+
+    def test_complete_output(self):
+        self.assertEqual(self.extract('去南京', '[{"address": "南京"}]', 'stop'), [{"address": "南京"}])
+
+
+if __name__ == '__main__':
+    unittest.main()
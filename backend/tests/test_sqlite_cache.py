@@ -0,0 +1,79 @@
+"""SQLite缓存的过期时间、条数上限和旧表迁移测试"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from app.utils.sqlite_cache import SQLiteCache
+
+
+class SQLiteCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_expired_entry_is_missed(self):
+        cache = SQLiteCache(self.path, ttl=60)
+        cache.set('fresh', 'a')
+        cache.set('stale', 'b', ttl=-1)
+        self.assertEqual(cache.get('fresh'), 'a')
+        self.assertIsNone(cache.get('stale'))
+
+    def test_max_rows_evicts_oldest(self):
+        cache = SQLiteCache(self.path, max_rows=10)
+        for i in range(SQLiteCache.PRUNE_INTERVAL):
+            cache.set(str(i), str(i))
+        self.assertIsNone(cache.get('0'))
+        self.assertEqual(cache.get(str(SQLiteCache.PRUNE_INTERVAL - 1)), str(SQLiteCache.PRUNE_INTERVAL - 1))
+        (count,) = cache._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        self.assertEqual(count, 10)
+
+    def test_migrates_table_without_expiry(self):
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute(
+                "CREATE TABLE cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("INSERT INTO cache VALUES ('old', 'v', ?)", (time.time(),))
+        conn.close()
+
+        cache = SQLiteCache(self.path, ttl=60)
+        self.assertEqual(cache.get('old'), 'v')
+        cache.set('new', 'w')
+        self.assertEqual(cache.get('new'), 'w')
+
+    def test_locked_by_other_connection(self):
+        cache = SQLiteCache(self.path)
+        cache.set('key', 'value')
+        other = sqlite3.connect(self.path)
+        other.execute("BEGIN EXCLUSIVE")
+        try:
+            # WAL模式下读取不受其他连接的写锁影响，写入最多等待BUSY_TIMEOUT后放弃
+            start = time.monotonic()
+            self.assertEqual(cache.get('key'), 'value')
+            cache.set('other', 'value')
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            other.rollback()
+            other.close()
+
+    def test_async_access(self):
+        cache = SQLiteCache(self.path)
+
+        async def run():
+            await cache.aset('key', 'value')
+            return await cache.aget('key')
+
+        self.assertEqual(asyncio.run(run()), 'value')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""流式地址提取与批量地理编码重叠执行的测试"""
+import asyncio
+import unittest
+
+from app.core.text_processor import TextProcessor
+from app.services.amap_service import GEOCODE_BATCH_SIZE
+
+
+class FakeQwen:
+    """按给定节奏产出地址，delay为None时连续产出不让出事件循环"""
+
+    def __init__(self, count, delay=None):
+        self.count = count
+        self.delay = delay
+        self.cancelled = False
+
+    async def stream_addresses(self, text):
+        try:
+            for i in range(self.count):
+                if self.delay is not None:
+                    await asyncio.sleep(self.delay)
+                yield {"address": f"addr{i}"}
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+class FakeAMap:
+    """记录每次批量请求的地址，fail_on中的地址会使该批请求抛出异常"""
+
+    def __init__(self, fail_on=()):
+        self.batches = []
+        self.fail_on = set(fail_on)
+
+    async def geocode_batch(self, addresses):
+        self.batches.append(list(addresses))
+        await asyncio.sleep(0)
+        if self.fail_on & set(addresses):
+            raise ValueError("geocode failed")
+        return [{"formatted_address": address} for address in addresses]
+
+
+class ExtractAndGeocodeTest(unittest.TestCase):
+
+    def run_extract(self, qwen, amap):
+        return asyncio.run(TextProcessor(qwen, amap)._extract_and_geocode("text"))
+
+    def test_burst_is_grouped_into_batches(self):
+        amap = FakeAMap()
+        count = GEOCODE_BATCH_SIZE * 2 + 3
+        addresses, geocoded = self.run_extract(FakeQwen(count), amap)
+
+        self.assertEqual([len(batch) for batch in amap.batches], [GEOCODE_BATCH_SIZE, GEOCODE_BATCH_SIZE, 3])
+        self.assertEqual(len(addresses), count)
+        self.assertEqual([location["formatted_address"] for location in geocoded],
+                         [address["address"] for address in addresses])
+
+    def test_slow_stream_sends_each_address(self):
+        amap = FakeAMap()
+        addresses, geocoded = self.run_extract(FakeQwen(3, delay=0.01), amap)
+
+        self.assertEqual(amap.batches, [["addr0"], ["addr1"], ["addr2"]])
+        self.assertEqual([location["formatted_address"] for location in geocoded], ["addr0", "addr1", "addr2"])
+
+    def test_empty_stream(self):
+        amap = FakeAMap()
+        self.assertEqual(self.run_extract(FakeQwen(0), amap), ([], []))
+        self.assertEqual(amap.batches, [])
+
+    def test_failed_batch_raises(self):
+        amap = FakeAMap(fail_on={"addr1"})
+        with self.assertRaises(ValueError):
+            self.run_extract(FakeQwen(3, delay=0.01), amap)
+        self.assertEqual(len(amap.batches), 3)
+
+    def test_cancel_stops_stream(self):
+        qwen = FakeQwen(100, delay=0.01)
+
+        async def run():
+            task = asyncio.ensure_future(TextProcessor(qwen, FakeAMap())._extract_and_geocode("text"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # 让被取消的生产者任务执行完清理
+            await asyncio.sleep(0)
+            self.assertTrue(qwen.cancelled)
+
+        asyncio.run(run())
+
+if __name__ == '__main__':
+    unittest.main()